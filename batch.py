@@ -0,0 +1,226 @@
+import argparse
+import pickle
+import time
+from random import Random
+
+import numpy as np
+
+from logic import *
+from qtable import (ACTION_CODES, BLANK_STATE_ID, HISTORY_LENGTH, NUM_STATES, ORIENTATION_CODES, STANCE_CODES,
+                    DenseQTable, encode_states, load_table)
+
+FIGHTERS = [RYU, KEN]
+RYU_ID, KEN_ID = 0, 1
+
+STANDING = STANCE_CODES[STANCE_STANDING]
+NONE = ACTION_CODES[ACTION_NONE]
+RESET_STANCE_ACTIONS = np.array([a in (ACTION_JUMP, ACTION_CROUCH) for a in ACTIONS])
+MOVE_DELTAS = np.array([MOVES[a][0] if a in MOVES else 0 for a in ACTIONS])
+MOVE_ORIENTATIONS = np.array([ORIENTATION_CODES[MOVES[a][1]] if a in MOVES else -1 for a in ACTIONS])
+STANCE_TRANSITIONS = np.array([STANCE_CODES[STANCE_CHANGES[a]] if a in STANCE_CHANGES else -1 for a in ACTIONS])
+HITS = np.array([[[a in STANCE_HIT_MAP[s][o] for a in ACTIONS] for o in STANCES] for s in STANCES])
+START_POSITIONS = np.array([RYU_START, KEN_START])
+START_ORIENTATIONS = np.array([ORIENTATION_CODES[ORIENTATION_RIGHT], ORIENTATION_CODES[ORIENTATION_LEFT]])
+
+
+class BatchGame:
+    def __init__(self, fights=1024, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, noise=0,
+                 seed=None, exact=False, dtype=np.float32):
+        self.fights = fights
+        self.learning_rate = learning_rate
+        self.discount_factor = discount_factor
+        # exact mode steps fights one by one and draws from the same streams as a Game seeded with seed,
+        # so a 1-fight batch reproduces the scalar engine step for step
+        self.exact = exact
+        self.rng = np.random.default_rng(seed)
+        if exact:
+            game_rng = Random(seed)
+            self.agent_rngs = [Random(game_rng.getrandbits(64)) for _ in PLAYERS]
+            self.turn_order = random_blocks(lambda: game_rng.choices(PLAYERS, k=RANDOM_BLOCK))
+            self.exploration_actions = [random_blocks(lambda rng=rng: rng.choices(ACTIONS, k=RANDOM_BLOCK))
+                                        for rng in self.agent_rngs]
+        self.max_wins = MAX_WIN
+        self.wins = 0
+        self.ryu_wins = 0
+        self.ken_wins = 0
+        self.iterations = 0
+        self.noise = np.array([noise, noise], dtype=np.float64)
+
+        # one qtable per fighter, stored back to back so both can be indexed in a single operation
+        self.values = np.zeros((len(FIGHTERS), NUM_STATES, len(ACTIONS)), dtype=dtype)
+        self.visited = np.zeros((len(FIGHTERS), NUM_STATES), dtype=bool)
+        self.qtables = [DenseQTable(dtype, self.values[f], self.visited[f]) for f in (RYU_ID, KEN_ID)]
+        self.flat_values = self.values.reshape(-1, len(ACTIONS))
+        self.flat_visited = self.visited.reshape(-1)
+
+        # per player arrays are flat: slot = fighter * fights + fight
+        players = len(FIGHTERS) * fights
+        self.fighters = np.repeat(np.arange(len(FIGHTERS)), fights)
+        self.positions = np.repeat(START_POSITIONS, fights)
+        self.orientations = np.repeat(START_ORIENTATIONS, fights)
+        self.stances = np.full(players, STANDING)
+        self.health = np.full(players, 100)
+        self.scores = np.zeros(players, dtype=np.int64)
+        self.previous_actions = np.full((players, HISTORY_LENGTH), NONE)
+        self.current_actions = np.full(players, NONE)
+        self.states = np.full(players, BLANK_STATE_ID)
+        self.previous_states = np.full(players, BLANK_STATE_ID)
+
+    def load_qtable(self, fighter, filename):
+        qtable = DenseQTable.from_dict(load_table(filename), self.values.dtype)
+        self.values[fighter] = qtable.values
+        self.visited[fighter] = qtable.visited
+
+    def save(self, fighter, filename):
+        with open(filename, 'wb') as file:
+            pickle.dump(self.qtables[fighter].to_dict(), file)
+
+    def opponents(self, players):
+        return (players + self.fights) % len(self.positions)
+
+    def qtable_rows(self, players, states):
+        return self.fighters[players] * NUM_STATES + states
+
+    def radar_states(self, players):
+        opponents = self.opponents(players)
+        return encode_states(self.positions[players], self.positions[opponents], self.stances[opponents],
+                             self.orientations[players], self.stances[players], self.previous_actions[opponents])
+
+    def draw_players(self, fights):
+        if self.exact:
+            fighters = np.array([FIGHTERS.index(next(self.turn_order)) for _ in fights])
+        else:
+            fighters = self.rng.integers(len(FIGHTERS), size=len(fights))
+        return fighters * self.fights + fights
+
+    def choose_actions(self, players):
+        rows = self.qtable_rows(players, self.states[players])
+        if self.exact:
+            fighter = self.fighters[players[0]]
+            if self.noise[fighter] and self.agent_rngs[fighter].random() < self.noise[fighter]:
+                self.noise[fighter] *= 0.9999
+                return np.array([ACTION_CODES[next(self.exploration_actions[fighter])]])
+            self.flat_visited[rows] = True
+            return self.flat_values[rows].argmax(axis=1)
+        actions = self.flat_values[rows].argmax(axis=1)
+        explore = self.rng.random(len(players)) < self.noise[self.fighters[players]]
+        if explore.any():
+            explorations = np.bincount(self.fighters[players[explore]], minlength=len(FIGHTERS))
+            self.noise *= 0.9999 ** explorations
+            actions[explore] = self.rng.integers(len(ACTIONS), size=np.count_nonzero(explore))
+            rows = rows[~explore]
+        self.flat_visited[rows] = True
+        return actions
+
+    def update_qtable(self, players, prev_states, actions, rewards, new_states):
+        prev_rows = self.qtable_rows(players, prev_states)
+        new_rows = self.qtable_rows(players, new_states)
+        self.flat_visited[prev_rows] = True
+        self.flat_visited[new_rows] = True
+        max_q = self.flat_values[new_rows].max(axis=1).astype(np.float64)
+        q = self.flat_values[prev_rows, actions].astype(np.float64)
+        # fights sharing a (state, action) in the same step keep the last write, as in hogwild updates
+        self.flat_values[prev_rows, actions] = q + self.learning_rate * (rewards + self.discount_factor * max_q - q)
+
+    def env_do(self, players, actions):
+        opponents = self.opponents(players)
+        stances = self.stances[players]
+        reset = (stances != STANDING) & RESET_STANCE_ACTIONS[self.previous_actions[players, 1]]
+        stances[reset] = STANDING
+
+        orientations = MOVE_ORIENTATIONS[actions]
+        moving = orientations >= 0
+        self.orientations[players[moving]] = orientations[moving]
+        deltas = MOVE_DELTAS[actions]
+        positions = self.positions[players] + deltas
+        blocked = (positions <= LogicEnvironment.LEFT_WALL) | (positions >= LogicEnvironment.RIGHT_WALL)
+        positions[blocked] -= deltas[blocked]
+        self.positions[players] = positions
+
+        new_stances = STANCE_TRANSITIONS[actions]
+        changing = new_stances >= 0
+        stances[changing] = new_stances[changing]
+        self.stances[players] = stances
+
+        directions = 2 * self.orientations[players] - 1
+        hits = HITS[stances, self.stances[opponents], actions]
+        hits &= self.positions[opponents] == positions + directions
+        self.health[opponents[hits]] -= HIT_DAMAGE
+        return np.where(hits, REWARD_HIT, REWARD_NONE)
+
+    def agents_do(self, players):
+        actions = self.choose_actions(players)
+        self.current_actions[players] = actions
+        rewards = self.env_do(players, actions)
+        self.scores[players] += rewards
+        new_states = self.radar_states(players)
+        states = self.states[players]
+        self.update_qtable(players, states, actions, rewards, new_states)
+        self.previous_states[players] = states
+        self.previous_actions[players, 1:] = self.previous_actions[players, :-1]
+        self.previous_actions[players, 0] = actions
+        self.states[players] = new_states
+
+    def check_end_game(self, fights):
+        ryu_dead = self.health[fights] <= 0
+        dead = ryu_dead | (self.health[fights + self.fights] <= 0)
+        if not dead.any():
+            return
+        fights = fights[dead]
+        winners = np.where(ryu_dead[dead], fights + self.fights, fights)
+        self.scores[winners] += REWARD_WIN
+        self.update_qtable(winners, self.previous_states[winners], self.current_actions[winners],
+                           REWARD_WIN, self.states[winners])
+        ryu_wins = int(np.count_nonzero(~ryu_dead[dead]))
+        self.ryu_wins += ryu_wins
+        self.ken_wins += len(fights) - ryu_wins
+        self.wins += len(fights)
+        self.reset(fights)
+
+    def reset(self, fights):
+        players = np.concatenate((fights, fights + self.fights))
+        self.positions[players] = np.repeat(START_POSITIONS, len(fights))
+        self.orientations[players] = np.repeat(START_ORIENTATIONS, len(fights))
+        self.stances[players] = STANDING
+        self.health[players] = 100
+        self.scores[players] = 0
+        self.states[players] = self.radar_states(players)
+
+    def step(self, fights):
+        players = self.draw_players(fights)
+        self.agents_do(players)
+        self.iterations += len(fights)
+        self.check_end_game(fights)
+
+    def round(self):
+        if self.exact:
+            for fight in range(self.fights):
+                self.step(np.array([fight]))
+        else:
+            self.step(np.arange(self.fights))
+
+    def run(self):
+        while self.wins < self.max_wins:
+            self.round()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('learning_rate', type=float, help='learning rate in percent')
+    parser.add_argument('discount_factor', type=float, help='discount factor in percent')
+    parser.add_argument('--fights', type=int, default=1024, help='number of fights stepped together')
+    parser.add_argument('--wins', type=int, default=MAX_WIN, help='total fights to play')
+    parser.add_argument('--noise', type=float, default=0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--exact', action='store_true', help='reproduce the scalar engine step for step')
+    args = parser.parse_args()
+    game = BatchGame(args.fights, args.learning_rate / 100.0, args.discount_factor / 100.0, args.noise,
+                     args.seed, args.exact)
+    game.max_wins = args.wins
+    start = time.perf_counter()
+    game.run()
+    elapsed = time.perf_counter() - start
+    print(f'{game.iterations} steps, {game.wins} fights in {elapsed:.2f}s '
+          f'({game.iterations / elapsed:.0f} steps/s), Ryu wins {game.ryu_wins}, Ken wins {game.ken_wins}')
+    game.save(RYU_ID, "RyuQtable.qtable")
+    game.save(KEN_ID, "KenQtable.qtable")
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import import_module
+
+from logic import (ACTIONS, BUCKETING_LINEAR, BUCKETING_LOG, KEN, QTABLE_BINARY_EXTENSION, QTABLE_DICT, RADAR_RADIUS,
+                   RYU, Arena, LogicEnvironment)
+
+IMPORT_BUDGET_MS = 100
+IMPORT_RUNS = 10
+HEADLESS_IMPORT = "import importlib; importlib.import_module('no-graphic')"
+HEAVY_MODULES = ['matplotlib', 'arcade', 'numpy']
+
+SEED = 42
+WARMUP_WINS = 200
+MICRO_CALLS = 20_000
+MACRO_STEPS = 100_000
+QTABLE_SIZES = [1_000, 10_000, 100_000]
+ARENA_WIDTHS = [10, 30, 100, 300, 1000]
+ARENA_STEPS = 100_000
+# radius and bucketing of the radar compared on every width
+ARENA_RADARS = [(RADAR_RADIUS, BUCKETING_LINEAR), (5, BUCKETING_LOG)]
+REPEAT = 5
+REGRESSION_THRESHOLD = 0.10
+BASELINE_FILE = "benchmark_baseline.json"
+
+
+def python_run_time(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def import_time(code=HEADLESS_IMPORT, runs=IMPORT_RUNS):
+    # cost of the imports alone: interpreter startup is measured separately and subtracted
+    startup = statistics.median(python_run_time('pass') for _ in range(runs))
+    total = statistics.median(python_run_time(code) for _ in range(runs))
+    return (total - startup) * 1000
+
+
+def heavy_imports(code=HEADLESS_IMPORT):
+    check = f"{code}; import sys; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', check], check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return output.stdout.split()
+
+
+def bench_imports(budget=IMPORT_BUDGET_MS, runs=IMPORT_RUNS):
+    elapsed = import_time(runs=runs)
+    heavy = heavy_imports()
+    print(f'headless imports: {elapsed:.1f} ms (budget {budget} ms)')
+    if heavy:
+        print(f'headless imports pull in: {", ".join(heavy)}')
+    return elapsed <= budget and not heavy
+
+
+def best_time(function, repeat=REPEAT):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def trained_game(seed=SEED, wins=WARMUP_WINS, qtable_backend=QTABLE_DICT):
+    game = import_module('no-graphic').NonGraphic(qtable_backend=qtable_backend, seed=seed)
+    game.setup()
+    game.max_wins = wins
+    game.train()
+    return game
+
+
+def bench_micro(calls=MICRO_CALLS, qtable_backend=QTABLE_DICT):
+    game = trained_game(qtable_backend=qtable_backend)
+    env, ryu = game.env, game.Ryu
+    prev_state, new_state = ryu.previous_state, ryu.state
+
+    def get_radar():
+        for _ in range(calls):
+            env.invalidate_radars(RYU)
+            env.get_radar(RYU)
+
+    def get_radar_cached():
+        for _ in range(calls):
+            env.get_radar(RYU)
+
+    def env_do():
+        for i in range(calls):
+            ryu.current_action = ACTIONS[i % len(ACTIONS)]
+            env.do(RYU)
+        env.reset()
+
+    def env_do_table():
+        env.use_transition_table()
+        try:
+            env_do()
+        finally:
+            del env.do
+
+    def choose_action():
+        ryu.seed(SEED)
+        for _ in range(calls):
+            ryu.choose_action()
+
+    def update_qtable():
+        for _ in range(calls):
+            ryu.update_qtable(-2, prev_state, new_state)
+
+    results = {}
+    for name, function in [('get_radar', get_radar), ('get_radar_cached', get_radar_cached), ('env_do', env_do),
+                           ('env_do_table', env_do_table), ('choose_action', choose_action), ('update_qtable', update_qtable)]:
+        results[f'{name}_calls_per_sec'] = calls / best_time(function)
+    return results
+
+
+def bench_macro(steps=MACRO_STEPS, qtable_backend=QTABLE_DICT):
+    game = trained_game(qtable_backend=qtable_backend)
+    wins = game.wins
+    start = time.perf_counter()
+    for _ in range(steps):
+        game.round()
+        game.check_end_game()
+    elapsed = time.perf_counter() - start
+    return {
+        'round_steps_per_sec': steps / elapsed,
+        'round_episodes_per_sec': (game.wins - wins) / elapsed,
+    }
+
+
+def bench_arena(widths=ARENA_WIDTHS, steps=ARENA_STEPS, radars=ARENA_RADARS):
+    # same number of steps on each width: steps/s and the qtable size should not depend on the width
+    results = {}
+    for radius, bucketing in radars:
+        for width in widths:
+            arena = Arena(width, radius, bucketing)
+            game = import_module('no-graphic').NonGraphic(seed=SEED, arena=arena)
+            game.setup()
+            start = time.perf_counter()
+            for _ in range(steps):
+                game.round()
+                game.check_end_game()
+            elapsed = time.perf_counter() - start
+            name = f'arena_{bucketing}{radius}_{width}'
+            results[f'{name}_steps_per_sec'] = steps / elapsed
+            results[f'{name}_qtable_rows'] = len(game.Ryu.qtable)
+            # every layout of the narrow arenas is built up front, the wide ones only build those they meet
+            results[f'{name}_radar_layouts'] = len(arena.layouts)
+            print(f'{bucketing} radius {radius}, {width} cells: {steps / elapsed:.0f} steps/s, {game.wins} fights, '
+                  f'{len(game.Ryu.qtable)} Ryu states, {len(arena.layouts)} radar layouts')
+    return results
+
+
+def random_qtable(size, seed=SEED):
+    rng = random.Random(seed)
+    cells = ['_', '#', 'S', 'C', 'J']
+    qtable = {}
+    while len(qtable) < size:
+        state = tuple(rng.choice(cells) for _ in range(7)) + (rng.choice([-1, 1]), rng.choice('SCJ')) \
+            + tuple(rng.choice(ACTIONS) for _ in range(3))
+        qtable[state] = {action: rng.uniform(-200, 200) for action in ACTIONS}
+    return qtable
+
+
+def bench_qtable_io(sizes=QTABLE_SIZES):
+    from qtable import MappedQTable
+    results = {}
+    env = LogicEnvironment()
+    agent = env.agents[KEN]
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            qtable = random_qtable(size)
+            for extension in ['.qtable', QTABLE_BINARY_EXTENSION]:
+                filename = os.path.join(directory, f'bench{extension}')
+                fmt = extension.lstrip('.')
+                agent.qtable = qtable
+                agent.qtable_backend = QTABLE_DICT
+                results[f'save_{fmt}_{size}_sec'] = best_time(lambda: agent.save(filename), 3)
+                results[f'load_{fmt}_{size}_sec'] = best_time(lambda: agent.load_qtable(filename), 3)
+            results[f'open_mapped_{size}_sec'] = best_time(lambda: MappedQTable(filename), 3)
+    return results
+
+
+def run_suite(groups):
+    results = {}
+    if 'micro' in groups:
+        results.update(bench_micro())
+    if 'macro' in groups:
+        results.update(bench_macro())
+    if 'qtable' in groups:
+        results.update(bench_qtable_io())
+    if 'arena' in groups:
+        results.update(bench_arena())
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # *_per_sec metrics are better when higher, *_sec timings when lower
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        change = value / old - 1 if name.endswith('_per_sec') else old / value - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:40} {old:14.6g} -> {value:14.6g} {change:+7.1%}{flag}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hadoken benchmarks')
+    parser.add_argument('groups', nargs='*', default=['imports', 'micro', 'macro', 'qtable'],
+                        help='imports, micro, macro, qtable and/or arena (not run by default)')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_MS, help='max headless import time in ms')
+    parser.add_argument('--runs', type=int, default=IMPORT_RUNS)
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='allowed slowdown ratio')
+    args = parser.parse_args()
+
+    ok = True
+    if 'imports' in args.groups:
+        ok = bench_imports(args.import_budget, args.runs)
+    results = run_suite(args.groups)
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'seed': SEED, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'baseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            ok = not compare(results, json.load(file)['results'], args.threshold) and ok
+    else:
+        for name, value in sorted(results.items()):
+            print(f'{name:40} {value:14.6g}')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,124 @@
+import json
+import os
+import pickle
+import shutil
+from queue import Full, Queue
+from threading import Thread
+from time import monotonic
+
+from logic import KEN, PLAYERS, QTABLE_DENSE, QTABLE_SPARSE, RYU
+
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_KEEP = 3
+STATE_FILE = "state.json"
+
+
+def snapshot_qtable(agent):
+    # copying in memory is the only work left on the training thread, the writer thread does the rest
+    if agent.qtable_backend == QTABLE_DENSE:
+        from qtable import DenseQTable
+        return DenseQTable(values=agent.qtable.values.copy(), visited=agent.qtable.visited.copy())
+    if agent.qtable_backend == QTABLE_SPARSE:
+        from sparse import SparseQTable
+        return SparseQTable({state: row[:] for state, row in agent.qtable.rows.items()})
+    return {state: dict(actions) for state, actions in agent.qtable.items()}
+
+
+def checkpoint_path(directory, wins):
+    return os.path.join(directory, f'{wins:09d}')
+
+
+def list_checkpoints(directory=CHECKPOINT_DIR):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if os.path.exists(os.path.join(directory, name, STATE_FILE)))
+
+
+def latest_checkpoint(directory=CHECKPOINT_DIR):
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def resume(game, path):
+    with open(os.path.join(path, STATE_FILE)) as file:
+        state = json.load(file)
+    game.wins = state['wins']
+    game.ryu_wins = state['ryu_wins']
+    game.ken_wins = state['ken_wins']
+    game.iterations = state['iterations']
+    for player in PLAYERS:
+        agent = game.env.agents[player]
+        agent.load_qtable(os.path.join(path, f'{player}.qtable'))
+        agent.noise = state['noise'][player]
+    if game.checkpointer is not None:
+        game.checkpointer.last_wins = game.wins
+    if game.convergence is not None:
+        game.convergence.last_wins, game.convergence.last_ryu_wins = game.wins, game.ryu_wins
+    return state
+
+
+class Checkpointer:
+    def __init__(self, directory=CHECKPOINT_DIR, every_wins=None, every_seconds=None, keep=CHECKPOINT_KEEP):
+        self.directory = directory
+        self.every_wins = every_wins
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.last_wins = 0
+        self.last_time = monotonic()
+        self.queue = Queue(maxsize=1)
+        self.writer = Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def is_due(self, game):
+        if self.every_wins and game.wins - self.last_wins >= self.every_wins:
+            return True
+        return bool(self.every_seconds) and monotonic() - self.last_time >= self.every_seconds
+
+    def maybe_save(self, game):
+        if self.is_due(game):
+            self.save(game)
+
+    def save(self, game, wait=False):
+        snapshot = {
+            'wins': game.wins,
+            'ryu_wins': game.ryu_wins,
+            'ken_wins': game.ken_wins,
+            'iterations': game.iterations,
+            'noise': {RYU: game.Ryu.noise, KEN: game.Ken.noise},
+            'qtables': {RYU: snapshot_qtable(game.Ryu), KEN: snapshot_qtable(game.Ken)},
+        }
+        try:
+            self.queue.put(snapshot, block=wait)
+        except Full:
+            # previous checkpoint still being written, try again after the next fight
+            return
+        self.last_wins = game.wins
+        self.last_time = monotonic()
+
+    def write_loop(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                return
+            self.write(snapshot)
+
+    def write(self, snapshot):
+        path = checkpoint_path(self.directory, snapshot['wins'])
+        os.makedirs(path, exist_ok=True)
+        for player, qtable in snapshot.pop('qtables').items():
+            if not isinstance(qtable, dict):
+                qtable = qtable.to_dict()
+            with open(os.path.join(path, f'{player}.qtable'), 'wb') as file:
+                pickle.dump(qtable, file)
+        # the state file is written last: a checkpoint without it is incomplete and ignored
+        state_file = os.path.join(path, STATE_FILE)
+        with open(state_file + '.tmp', 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(state_file + '.tmp', state_file)
+        for old in list_checkpoints(self.directory)[:-self.keep]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
@@ -0,0 +1,184 @@
+import argparse
+import os
+import pickle
+import time
+
+from logic import (ACTION_LEFT, ACTION_RIGHT, ACTIONS, ARENA, PLAYERS, QTABLE_DENSE, QTABLE_DICT, QTABLE_MAPPED,
+                   QTABLE_SPARSE)
+from sparse import dict_nbytes
+
+COMPACT_EVERY = 10_000
+COMPACT_MIN_VALUE = 0.0
+MIRRORED_ACTIONS = {action: action for action in ACTIONS}
+MIRRORED_ACTIONS[ACTION_LEFT], MIRRORED_ACTIONS[ACTION_RIGHT] = ACTION_RIGHT, ACTION_LEFT
+
+
+def mirror_state(state, cells=ARENA.cells):
+    # the arena is symmetric: reversed radar slots, opposite orientation, the opponent's moves swapped;
+    # the blank start radar is its own mirror
+    if state[cells] == '_':
+        return state
+    return state[cells - 1::-1] + (-state[cells], state[cells + 1]) + tuple(MIRRORED_ACTIONS[action] for action in state[cells + 2:])
+
+
+def mirror_row(actions):
+    return {MIRRORED_ACTIONS[action]: value for action, value in actions.items()}
+
+
+class CanonicalStates(dict):
+    # radar -> (stored radar, mirrored), the stored one of a mirrored pair is the smaller tuple
+    def __init__(self, cells=ARENA.cells):
+        super().__init__()
+        self.cells = cells
+
+    def __missing__(self, state):
+        mirrored = mirror_state(state, self.cells)
+        self[state] = entry = (mirrored, True) if mirrored < state else (state, False)
+        return entry
+
+
+def compact(table, min_value=COMPACT_MIN_VALUE, visits=None, min_visits=None, ages=None, max_age=None, symmetric=False):
+    # rows whose values all stay within min_value of 0 are dropped: an unknown state starts at 0 for every
+    # action, so with the default 0.0 only rows that never learned anything go and the policy is unchanged.
+    # visits / ages (compaction passes since the last visit) are only known for tables compacted while training
+    kept = {}
+    for state, actions in table.items():
+        if max(abs(value) for value in actions.values()) <= min_value:
+            continue
+        if min_visits is not None and visits is not None and visits.get(state, 0) < min_visits:
+            continue
+        if max_age is not None and ages is not None and ages.get(state, 0) > max_age:
+            continue
+        kept[state] = dict(actions)
+    if symmetric:
+        kept = merge_mirrored(kept, visits)
+    return kept
+
+
+def merge_mirrored(table, visits=None):
+    # both rows of a mirrored pair are averaged into the stored one, weighted by their visits when known
+    canonical = CanonicalStates()
+    merged, weights = {}, {}
+    for state, actions in table.items():
+        stored, mirrored = canonical[state]
+        row = mirror_row(actions) if mirrored else actions
+        weight = max(visits.get(state, 0), 1) if visits is not None else 1
+        if stored not in merged:
+            merged[stored] = {action: row.get(action, 0.0) for action in ACTIONS}
+            weights[stored] = weight
+            continue
+        total = weights[stored] + weight
+        merged[stored] = {action: (value * weights[stored] + row.get(action, 0.0) * weight) / total
+                          for action, value in merged[stored].items()}
+        weights[stored] = total
+    return merged
+
+
+def expand(table):
+    # back to one row per radar, for tools that look states up directly (evaluate.py, batch.py)
+    expanded = {}
+    for state, actions in table.items():
+        expanded[state] = dict(actions)
+        expanded.setdefault(mirror_state(state), mirror_row(actions))
+    return expanded
+
+
+def table_from_dict(backend, table):
+    if backend == QTABLE_DENSE:
+        from qtable import DenseQTable
+        return DenseQTable.from_dict(table)
+    if backend == QTABLE_SPARSE:
+        from sparse import SparseQTable
+        return SparseQTable.from_dict(table)
+    return table
+
+
+def table_report(table):
+    return {'rows': len(table), 'bytes': dict_nbytes(table), 'pickle': len(pickle.dumps(table))}
+
+
+class Compactor:
+    # run from Game.check_end_game every `every` fights, compacts both qtables in place
+    def __init__(self, every=COMPACT_EVERY, min_value=COMPACT_MIN_VALUE, min_visits=None, max_age=None, symmetric=False):
+        self.every = every
+        self.min_value = min_value
+        self.min_visits = min_visits
+        self.max_age = max_age
+        self.symmetric = symmetric
+        self.last_wins = 0
+        self.ages = {player: {} for player in PLAYERS}
+        self.last_visits = {player: {} for player in PLAYERS}
+        self.reports = []
+
+    def attach(self, game):
+        # visit counts are only kept when a criterion needs them
+        for player in PLAYERS:
+            agent = game.env.agents[player]
+            if self.min_visits is not None or self.max_age is not None:
+                agent.visits = {}
+            if self.symmetric:
+                agent.use_symmetry()
+
+    def maybe_compact(self, game):
+        if game.wins - self.last_wins >= self.every:
+            self.compact(game)
+
+    def compact(self, game):
+        self.last_wins = game.wins
+        report = {'wins': game.wins}
+        for player in PLAYERS:
+            agent = game.env.agents[player]
+            if agent.qtable_backend == QTABLE_MAPPED:
+                continue
+            table = agent.qtable if agent.qtable_backend == QTABLE_DICT else agent.qtable.to_dict()
+            ages = self.update_ages(player, table, agent.visits)
+            before = len(table)
+            compacted = compact(table, self.min_value, agent.visits, self.min_visits, ages, self.max_age, self.symmetric)
+            if agent.visits is not None:
+                agent.visits = {state: count for state, count in agent.visits.items() if state in compacted}
+                self.last_visits[player] = dict(agent.visits)
+            agent.qtable = table_from_dict(agent.qtable_backend, compacted)
+            report[player] = (before, len(compacted))
+        self.reports.append(report)
+        return report
+
+    def update_ages(self, player, table, visits):
+        # compaction passes since each row was last updated
+        if visits is None:
+            return None
+        last, ages = self.last_visits[player], self.ages[player]
+        self.ages[player] = ages = {state: 0 if visits.get(state, 0) != last.get(state, 0) else ages.get(state, 0) + 1
+                                    for state in table}
+        return ages
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drop the rows of a saved qtable that carry no information, '
+                                                 'optionally keep a single row per mirrored pair of states')
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--min-value', type=float, default=COMPACT_MIN_VALUE,
+                        help='drop rows whose values all stay within this distance of 0')
+    parser.add_argument('--symmetric', action='store_true', help='merge mirrored states, train or play them with --symmetric')
+    parser.add_argument('--expand', action='store_true', help='write back one row per radar for a symmetric table')
+    args = parser.parse_args()
+    from qtable import load_table, save_table
+    table, load_time = timed(load_table, args.source)
+    if args.expand:
+        compacted = expand(table)
+    else:
+        compacted = compact(table, args.min_value, symmetric=args.symmetric)
+    _, save_time = timed(save_table, compacted, args.destination)
+    _, reload_time = timed(load_table, args.destination)
+    before, after = table_report(table), table_report(compacted)
+    print(f"rows {before['rows']} -> {after['rows']}, memory {before['bytes'] / 1e6:.2f} -> {after['bytes'] / 1e6:.2f} MB, "
+          f"pickle {before['pickle'] / 1e6:.2f} -> {after['pickle'] / 1e6:.2f} MB")
+    print(f'{args.source}: {os.path.getsize(args.source) / 1e6:.2f} MB loaded in {load_time:.3f}s, '
+          f'{args.destination}: {os.path.getsize(args.destination) / 1e6:.2f} MB saved in {save_time:.3f}s '
+          f'and loaded in {reload_time:.3f}s')
@@ -0,0 +1,106 @@
+from logic import ACTIONS, PLAYERS
+
+CONVERGENCE_EVERY = 5000
+# with a high learning rate the random turn order keeps moving some values by a whole win reward,
+# max |dQ| is reported but only checked when a threshold is given
+CONVERGENCE_DELTA = None
+CONVERGENCE_POLICY = 0.03
+CONVERGENCE_WIN_RATE = 0.02
+CONVERGENCE_PATIENCE = 3
+
+
+def parse_threshold(value):
+    return None if value == 'off' else float(value)
+
+
+def snapshot_rows(qtable):
+    return {state: tuple(actions[action] for action in ACTIONS) for state, actions in qtable.items()}
+
+
+def best_index(row):
+    # first maximum, the tie-break arg_max gets from the ACTIONS ordering of the rows
+    return max(range(len(row)), key=row.__getitem__)
+
+
+def compare(previous, current):
+    # largest |dQ| over every value, states added since the previous check start from 0
+    # and the fraction of the previously known states whose greedy action changed
+    zero = (0.0,) * len(ACTIONS)
+    max_delta = 0.0
+    changed = 0
+    for state, row in current.items():
+        old = previous.get(state, zero)
+        max_delta = max(max_delta, max(abs(new - value) for new, value in zip(row, old)))
+        if state in previous and best_index(row) != best_index(old):
+            changed += 1
+    return max_delta, changed / len(previous) if previous else 1.0
+
+
+class ConvergenceMonitor:
+    # checked after every fight from Game.check_end_game, measures the qtables every `every` fights;
+    # a criterion set to None is ignored, the run stops once all the others hold for `patience` checks in a row
+    def __init__(self, every=CONVERGENCE_EVERY, max_delta=CONVERGENCE_DELTA, policy_change=CONVERGENCE_POLICY,
+                 win_rate=CONVERGENCE_WIN_RATE, patience=CONVERGENCE_PATIENCE):
+        self.every = every
+        self.max_delta = max_delta
+        self.policy_change = policy_change
+        self.win_rate = win_rate
+        self.patience = patience
+        self.last_wins = 0
+        self.last_ryu_wins = 0
+        self.snapshots = None
+        self.win_rates = []
+        self.streak = 0
+        self.history = []
+        self.converged = False
+
+    def maybe_check(self, game):
+        if game.wins - self.last_wins >= self.every:
+            return self.check(game)
+        return False
+
+    def check(self, game):
+        snapshots = {player: snapshot_rows(game.env.agents[player].qtable) for player in PLAYERS}
+        fights = game.wins - self.last_wins
+        self.win_rates.append((game.ryu_wins - self.last_ryu_wins) / fights if fights else 0.0)
+        self.last_wins, self.last_ryu_wins = game.wins, game.ryu_wins
+        if self.snapshots is None:
+            self.snapshots = snapshots
+            return False
+        deltas, changes = zip(*(compare(self.snapshots[player], snapshots[player]) for player in PLAYERS))
+        self.snapshots = snapshots
+        recent = self.win_rates[-self.patience - 1:]
+        record = {
+            'wins': game.wins,
+            'iterations': game.iterations,
+            'max_delta': max(deltas),
+            'policy_change': max(changes),
+            'win_rate_spread': max(recent) - min(recent),
+        }
+        self.history.append(record)
+        if self.holds(record):
+            self.streak += 1
+        else:
+            self.streak = 0
+        self.converged = self.streak >= self.patience
+        return self.converged
+
+    def holds(self, record):
+        if self.max_delta is not None and record['max_delta'] > self.max_delta:
+            return False
+        if self.policy_change is not None and record['policy_change'] > self.policy_change:
+            return False
+        # the win rate has to stay in the band over the whole patience window, not just between two checks
+        if self.win_rate is not None and (len(self.win_rates) <= self.patience or record['win_rate_spread'] > self.win_rate):
+            return False
+        return True
+
+    def report(self):
+        last = self.history[-1] if self.history else {}
+        return {
+            'converged': self.converged,
+            'converged_at': last.get('wins') if self.converged else None,
+            'max_delta': last.get('max_delta'),
+            'policy_change': last.get('policy_change'),
+            'win_rate_spread': last.get('win_rate_spread'),
+        }
@@ -0,0 +1,219 @@
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from batch import FIGHTERS, KEN_ID, RYU_ID, BatchGame
+from logic import ACTIONS, ATTACKS, KEN, REWARD_HIT, RYU
+
+EVALUATION_FIGHTS = 10_000
+BATCH_FIGHTS = 1024
+MAX_FIGHT_LENGTH = 1000
+Z_95 = 1.96
+TOURNAMENT_FILE = "tournament.json"
+
+ATTACK_ACTIONS = np.array([action in ATTACKS for action in ACTIONS])
+
+
+def wilson_interval(successes, total, z=Z_95):
+    if total == 0:
+        return 0.0, 0.0
+    p = successes / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def mean_interval(values, z=Z_95):
+    if len(values) == 0:
+        return 0.0, (0.0, 0.0)
+    mean = float(np.mean(values))
+    half = z * float(np.std(values)) / math.sqrt(len(values))
+    return mean, (mean - half, mean + half)
+
+
+class EvaluationGame(BatchGame):
+    # greedy replay of two fixed tables: no exploration, no learning, fights longer than max_length are draws
+    def __init__(self, ryu_file, ken_file, fights=BATCH_FIGHTS, max_length=MAX_FIGHT_LENGTH, seed=None):
+        super().__init__(fights, noise=0, seed=seed, dtype=np.float64)
+        self.load_qtable(RYU_ID, ryu_file)
+        self.load_qtable(KEN_ID, ken_file)
+        # like LogicAgent.load_qtable, agents start from their radar rather than the blank state
+        self.reset(np.arange(fights))
+        self.max_length = max_length
+        self.draws = 0
+        self.lengths = np.zeros(fights, dtype=np.int64)
+        self.active = np.zeros(fights, dtype=bool)
+        self.finished_lengths = []
+        self.hits = np.zeros(len(FIGHTERS), dtype=np.int64)
+        self.attacks = np.zeros(len(FIGHTERS), dtype=np.int64)
+
+    def update_qtable(self, players, prev_states, actions, rewards, new_states):
+        pass
+
+    def env_do(self, players, actions):
+        rewards = super().env_do(players, actions)
+        fighters = self.fighters[players]
+        self.attacks += np.bincount(fighters[ATTACK_ACTIONS[actions]], minlength=len(FIGHTERS))
+        self.hits += np.bincount(fighters[rewards == REWARD_HIT], minlength=len(FIGHTERS))
+        return rewards
+
+    def check_end_game(self, fights):
+        self.lengths[fights] += 1
+        dead = (self.health[fights] <= 0) | (self.health[fights + self.fights] <= 0)
+        if dead.any():
+            self.finished_lengths.append(self.lengths[fights[dead]])
+            self.lengths[fights[dead]] = 0
+            self.active[fights[dead]] = False
+            super().check_end_game(fights)
+        timeout = fights[self.lengths[fights] >= self.max_length]
+        if len(timeout):
+            self.draws += len(timeout)
+            self.lengths[timeout] = 0
+            self.active[timeout] = False
+            self.reset(timeout)
+
+    def played(self):
+        return self.wins + self.draws
+
+    def round(self):
+        active = np.flatnonzero(self.active)
+        if self.exact:
+            for fight in active:
+                self.step(np.array([fight]))
+        else:
+            self.step(active)
+
+    def run(self, total=EVALUATION_FIGHTS):
+        # fights are played in waves, each slot plays one fight and waits for the slowest one:
+        # restarting slots as soon as they finish would over-represent short fights
+        while self.played() < total:
+            self.active[:min(self.fights, total - self.played())] = True
+            while self.active.any():
+                self.round()
+
+    def results(self):
+        fights = self.played()
+        lengths = np.concatenate(self.finished_lengths) if self.finished_lengths else np.zeros(0)
+        length_avg, length_ci = mean_interval(lengths)
+        results = {'fights': fights, 'draws': self.draws, 'iterations': self.iterations,
+                   'length_avg': length_avg, 'length_ci': length_ci}
+        for player, fighter, wins in [(RYU, RYU_ID, self.ryu_wins), (KEN, KEN_ID, self.ken_wins)]:
+            prefix = player.lower()
+            hits, attacks = int(self.hits[fighter]), int(self.attacks[fighter])
+            results[f'{prefix}_wins'] = wins
+            results[f'{prefix}_win_rate'] = wins / fights if fights else 0.0
+            results[f'{prefix}_win_rate_ci'] = wilson_interval(wins, fights)
+            results[f'{prefix}_hit_rate'] = hits / attacks if attacks else 0.0
+            results[f'{prefix}_hit_rate_ci'] = wilson_interval(hits, attacks)
+        return results
+
+
+def evaluate(ryu_file, ken_file, fights=EVALUATION_FIGHTS, batch=BATCH_FIGHTS, max_length=MAX_FIGHT_LENGTH, seed=None):
+    game = EvaluationGame(ryu_file, ken_file, min(batch, fights), max_length, seed)
+    start = time.perf_counter()
+    game.run(fights)
+    elapsed = time.perf_counter() - start
+    results = game.results()
+    results['steps_per_sec'] = game.iterations / elapsed if elapsed > 0 else 0
+    return results
+
+
+def find_entrants(directory):
+    # Ryu_<key>.qtable / Ken_<key>.qtable pairs saved by launch.py --save-dir,
+    # or subdirectories holding Ryu.qtable and Ken.qtable such as checkpoints
+    entrants = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith(f'{RYU}_') and name.endswith('.qtable'):
+            key = name[len(RYU) + 1:-len('.qtable')]
+            ken_file = os.path.join(directory, f'{KEN}_{key}.qtable')
+            if os.path.exists(ken_file):
+                entrants[key] = (path, ken_file)
+        elif os.path.isdir(path):
+            ryu_file, ken_file = os.path.join(path, f'{RYU}.qtable'), os.path.join(path, f'{KEN}.qtable')
+            if os.path.exists(ryu_file) and os.path.exists(ken_file):
+                entrants[name] = (ryu_file, ken_file)
+    return entrants
+
+
+def match(ryu_name, ryu_file, ken_name, ken_file, fights, batch, max_length, seed):
+    results = evaluate(ryu_file, ken_file, fights, batch, max_length, seed)
+    return {'ryu': ryu_name, 'ken': ken_name, **results}
+
+
+def standings(entrants, matches):
+    table = {name: {'wins': 0, 'losses': 0, 'draws': 0, 'fights': 0} for name in entrants}
+    for result in matches:
+        for name, wins, losses in [(result['ryu'], result['ryu_wins'], result['ken_wins']),
+                                   (result['ken'], result['ken_wins'], result['ryu_wins'])]:
+            table[name]['wins'] += wins
+            table[name]['losses'] += losses
+            table[name]['draws'] += result['draws']
+            table[name]['fights'] += result['fights']
+    for row in table.values():
+        row['win_rate'] = row['wins'] / row['fights'] if row['fights'] else 0.0
+        row['win_rate_ci'] = wilson_interval(row['wins'], row['fights'])
+    return dict(sorted(table.items(), key=lambda item: -item[1]['win_rate']))
+
+
+def tournament(entrants, fights=EVALUATION_FIGHTS, batch=BATCH_FIGHTS, max_length=MAX_FIGHT_LENGTH, workers=None, seed=None):
+    # every entrant's Ryu table meets every other entrant's Ken table, so each pair plays both sides
+    pairings = [(a, b) for a in entrants for b in entrants if a != b]
+    matches = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(match, a, entrants[a][0], b, entrants[b][1], fights, batch, max_length,
+                               None if seed is None else seed + i)
+                   for i, (a, b) in enumerate(pairings)]
+        for future in as_completed(futures):
+            result = future.result()
+            matches.append(result)
+            print(f"{result['ryu']} (Ryu) vs {result['ken']} (Ken): {result['ryu_wins']} / {result['ken_wins']}, "
+                  f"{result['draws']} draws")
+    return {'matches': matches, 'standings': standings(entrants, matches)}
+
+
+def print_results(results):
+    print(f"{results['fights']} fights, {results['draws']} draws, "
+          f"length {results['length_avg']:.1f} [{results['length_ci'][0]:.1f}, {results['length_ci'][1]:.1f}], "
+          f"{results['steps_per_sec']:.0f} steps/s")
+    for player in [RYU, KEN]:
+        prefix = player.lower()
+        win_ci, hit_ci = results[f'{prefix}_win_rate_ci'], results[f'{prefix}_hit_rate_ci']
+        print(f"{player}: win rate {results[f'{prefix}_win_rate']:.1%} [{win_ci[0]:.1%}, {win_ci[1]:.1%}], "
+              f"hit rate {results[f'{prefix}_hit_rate']:.1%} [{hit_ci[0]:.1%}, {hit_ci[1]:.1%}]")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Greedy evaluation of trained qtables')
+    parser.add_argument('tables', nargs='*', help='Ryu and Ken qtables to play against each other')
+    parser.add_argument('--tournament', help='round-robin between the qtables of a launch.py --save-dir or checkpoint directory')
+    parser.add_argument('--fights', type=int, default=EVALUATION_FIGHTS, help='fights per match')
+    parser.add_argument('--batch', type=int, default=BATCH_FIGHTS, help='fights stepped together')
+    parser.add_argument('--max-length', type=int, default=MAX_FIGHT_LENGTH, help='iterations before a fight is a draw')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, help='parallel matches, defaults to the cpu count')
+    parser.add_argument('--output', help='write the results as json to this file')
+    args = parser.parse_args()
+
+    if args.tournament:
+        results = tournament(find_entrants(args.tournament), args.fights, args.batch, args.max_length,
+                             args.workers, args.seed)
+        for name, row in results['standings'].items():
+            print(f"{name:30} {row['win_rate']:6.1%} [{row['win_rate_ci'][0]:.1%}, {row['win_rate_ci'][1]:.1%}] "
+                  f"{row['wins']}W {row['losses']}L {row['draws']}D")
+        output = args.output or TOURNAMENT_FILE
+    elif len(args.tables) == 2:
+        results = evaluate(args.tables[0], args.tables[1], args.fights, args.batch, args.max_length, args.seed)
+        print_results(results)
+        output = args.output
+    else:
+        parser.error('give a Ryu and a Ken qtable, or --tournament <directory>')
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,208 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from logic import (ACTION_NONE, ACTIONS, GRID_LIMIT, HISTORY_LENGTH, KEN, KEN_START, ORIENTATION_LEFT,
+                   ORIENTATION_RIGHT, PLAYERS, RYU, RYU_START, STANCE_CHANGES, STANCE_STANDING, STANCES)
+from qtable import (ACTION_CODES, BLANK_STATE_ID, ORIENTATION_CODES, STANCE_CODES, DenseQTable,
+                    encode_states, load_table)
+from transitions import POSITIONS, transition
+
+ANALYSIS_FILE = "coverage.json"
+STARTS = {RYU: (RYU_START, ORIENTATION_RIGHT), KEN: (KEN_START, ORIENTATION_LEFT)}
+HISTORIES = len(ACTIONS) ** HISTORY_LENGTH
+
+
+def local_index(position, orientation, stance, history):
+    # history: code of the player's last HISTORY_LENGTH actions, most recent in the highest digit
+    return ((position * len(ORIENTATION_CODES) + orientation) * len(STANCES) + stance) * HISTORIES + history
+
+
+LOCAL_STATES = local_index(GRID_LIMIT, 0, 0, 0)
+
+
+def history_actions(history):
+    actions = []
+    for _ in range(HISTORY_LENGTH):
+        history, action = divmod(history, len(ACTIONS))
+        actions.insert(0, ACTIONS[action])
+    return actions
+
+
+def build_successors():
+    # a fighter's position, orientation, stance and history only change through its own actions: moves are
+    # not blocked by the opponent and a stance only resets on the fighter's own turn. Each player's states
+    # are explored on their own, the radar pairs any two of them
+    successors = np.full((LOCAL_STATES, len(ACTIONS)), -1, dtype=np.int64)
+    for history in range(HISTORIES):
+        actions = history_actions(history)
+        resets = actions[1] in STANCE_CHANGES
+        for position in POSITIONS:
+            for orientation in [ORIENTATION_LEFT, ORIENTATION_RIGHT]:
+                for stance in STANCES:
+                    state = local_index(position, ORIENTATION_CODES[orientation], STANCE_CODES[stance], history)
+                    for action in ACTIONS:
+                        new_position, new_orientation, new_stance, _, _ = transition(
+                            position, 0, orientation, stance, STANCE_STANDING, resets, action)
+                        new_history = (history // len(ACTIONS)) + ACTION_CODES[action] * len(ACTIONS) ** (HISTORY_LENGTH - 1)
+                        successors[state, ACTION_CODES[action]] = local_index(
+                            new_position, ORIENTATION_CODES[new_orientation], STANCE_CODES[new_stance], new_history)
+    return successors
+
+
+def explore(successors, player):
+    # breadth first from the start of a fight; a fight can end after any step (an over-approximation,
+    # ending needs the last hit), the fighters then go back to their start but keep their histories
+    start_position, start_orientation = STARTS[player]
+    blank_history = sum(ACTION_CODES[ACTION_NONE] * len(ACTIONS) ** i for i in range(HISTORY_LENGTH))
+    reached = np.zeros(LOCAL_STATES, dtype=bool)
+    frontier = np.array([local_index(start_position, ORIENTATION_CODES[start_orientation],
+                                     STANCE_CODES[STANCE_STANDING], blank_history)])
+    depth = 0
+    while len(frontier):
+        reached[frontier] = True
+        histories = np.unique(frontier % HISTORIES)
+        restarts = local_index(start_position, ORIENTATION_CODES[start_orientation], STANCE_CODES[STANCE_STANDING],
+                               histories)
+        candidates = np.unique(np.concatenate([successors[frontier].ravel(), restarts]))
+        frontier = candidates[~reached[candidates]]
+        depth += 1
+    return reached, depth
+
+
+def split_local(states):
+    rest, history = np.divmod(states, HISTORIES)
+    rest, stance = np.divmod(rest, len(STANCES))
+    position, orientation = np.divmod(rest, len(ORIENTATION_CODES))
+    return position, orientation, stance, history
+
+
+def history_codes(history):
+    # local history code -> (n, HISTORY_LENGTH) action codes, most recent first as encode_states expects
+    codes = np.empty((len(history), HISTORY_LENGTH), dtype=np.int64)
+    for i in range(HISTORY_LENGTH):
+        history, codes[:, HISTORY_LENGTH - 1 - i] = np.divmod(history, len(ACTIONS))
+    return codes
+
+
+def reachable_radars(reached, player):
+    # radar of `player`: its own position, orientation and stance against the opponent's position, stance and history
+    own = np.unique(np.stack(split_local(np.flatnonzero(reached[player]))[:3], axis=1), axis=0)
+    opponent = [other for other in PLAYERS if other != player][0]
+    position, _, stance, history = split_local(np.flatnonzero(reached[opponent]))
+    others = np.unique(np.stack([position, stance, history], axis=1), axis=0)
+    pairs_own = np.repeat(own, len(others), axis=0)
+    pairs_other = np.tile(others, (len(own), 1))
+    ids = encode_states(pairs_own[:, 0], pairs_other[:, 0], pairs_other[:, 1], pairs_own[:, 1], pairs_own[:, 2],
+                        history_codes(pairs_other[:, 2]))
+    return ids, pairs_own, pairs_other
+
+
+def load_dense(filename):
+    return DenseQTable.from_dict(load_table(filename), dtype=np.float64)
+
+
+def heatmap(rows, columns, shape, weights):
+    counts = np.zeros(shape)
+    np.add.at(counts, (rows, columns), weights)
+    return counts
+
+
+def analyse(player, ids, pairs_own, pairs_other, table):
+    # coverage of every reachable radar, and where the table's greedy policy is, by position and stance
+    states = np.unique(np.append(ids, BLANK_STATE_ID))
+    visited = table.visited[states]
+    greedy = table.values[states].argmax(axis=1)
+    pair_visited = table.visited[ids].astype(float)
+    shape_positions, shape_stances = (GRID_LIMIT, GRID_LIMIT), (len(STANCES), len(STANCES))
+    combos_by_position = heatmap(pairs_own[:, 0], pairs_other[:, 0], shape_positions, 1.0)
+    combos_by_stance = heatmap(pairs_own[:, 2], pairs_other[:, 1], shape_stances, 1.0)
+    with np.errstate(invalid='ignore'):
+        coverage_by_position = heatmap(pairs_own[:, 0], pairs_other[:, 0], shape_positions, pair_visited) / combos_by_position
+        coverage_by_stance = heatmap(pairs_own[:, 2], pairs_other[:, 1], shape_stances, pair_visited) / combos_by_stance
+    # greedy action mix of the visited radars per stance of the fighter, the blank start radar has none
+    known = visited & (states != BLANK_STATE_ID)
+    actions_by_stance = heatmap(states[known] // HISTORIES % len(STANCES), greedy[known], (len(STANCES), len(ACTIONS)), 1.0)
+    return {
+        'player': player,
+        'reachable_states': len(states),
+        'visited_states': int(visited.sum()),
+        'coverage': float(visited.mean()),
+        'table_states': len(table),
+        'unreachable_table_states': int(len(table) - visited.sum()),
+        'greedy_actions': {action: int((greedy[visited] == i).sum()) for i, action in enumerate(ACTIONS)},
+        'coverage_by_position': np.where(np.isnan(coverage_by_position), None, coverage_by_position.round(4)).tolist(),
+        'coverage_by_stance': {stance: dict(zip(STANCES, row)) for stance, row in zip(STANCES, coverage_by_stance.round(4).tolist())},
+        'greedy_actions_by_stance': {stance: dict(zip(ACTIONS, row)) for stance, row in zip(STANCES, actions_by_stance.astype(int).tolist())},
+    }, states[~visited], states, greedy
+
+
+def plot_heatmaps(analysis, output):
+    from matplotlib import pyplot as plt
+    coverage = np.array(analysis['coverage_by_position'], dtype=float)[1:-1, 1:-1]
+    stances = np.array([list(row.values()) for row in analysis['coverage_by_stance'].values()], dtype=float)
+    figure, (by_position, by_stance) = plt.subplots(1, 2, figsize=(10, 4))
+    image = by_position.imshow(coverage, vmin=0, vmax=1, origin='lower', extent=(0.5, len(coverage) + 0.5, 0.5, len(coverage) + 0.5))
+    by_position.set_xlabel('opponent position')
+    by_position.set_ylabel(f"{analysis['player']} position")
+    by_stance.imshow(stances, vmin=0, vmax=1, origin='lower')
+    by_stance.set_xticks(range(len(STANCES)), STANCES)
+    by_stance.set_yticks(range(len(STANCES)), STANCES)
+    by_stance.set_xlabel('opponent stance')
+    by_stance.set_ylabel(f"{analysis['player']} stance")
+    figure.colorbar(image, ax=[by_position, by_stance], label='coverage')
+    figure.savefig(output.format(player=analysis['player'].upper()))
+    plt.close(figure)
+
+
+def print_analysis(analysis):
+    print(f"{analysis['player']}: {analysis['visited_states']} / {analysis['reachable_states']} reachable radars in the "
+          f"table ({analysis['coverage']:.1%}), {analysis['table_states']} table states, "
+          f"{analysis['unreachable_table_states']} of them unreachable")
+    print('  coverage by position (rows: own position, columns: opponent position)')
+    for row in analysis['coverage_by_position'][1:-1]:
+        print('   ' + ' '.join('  -  ' if value is None else f'{value:5.0%}' for value in row[1:-1]))
+    print('  greedy actions: ' + ', '.join(f'{action} {count}' for action, count in analysis['greedy_actions'].items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reachable radar states from the game rules and the coverage of qtables')
+    parser.add_argument('--ryu', help='Ryu qtable to analyse')
+    parser.add_argument('--ken', help='Ken qtable to analyse')
+    parser.add_argument('--output', default=ANALYSIS_FILE, help='coverage and heatmaps as json')
+    parser.add_argument('--unvisited', help='write the unvisited reachable radars of each table to <file>_<player>.txt')
+    parser.add_argument('--policy', help='write the greedy action of every reachable radar to <file>_<player>.csv')
+    parser.add_argument('--heatmaps', help='plot the coverage by position and stance, e.g. graphs/{player}_coverage.png')
+    args = parser.parse_args()
+
+    from qtable import decode_state
+    start = time.perf_counter()
+    successors = build_successors()
+    reached, depths = {}, {}
+    for player in PLAYERS:
+        reached[player], depths[player] = explore(successors, player)
+    report = {'local_states': {player: int(reached[player].sum()) for player in PLAYERS}, 'bfs_depth': depths}
+    print(f'explored in {time.perf_counter() - start:.2f}s: ' + ', '.join(
+        f'{player} {reached[player].sum()} positions/orientations/stances/histories' for player in PLAYERS))
+    for player, filename in [(RYU, args.ryu), (KEN, args.ken)]:
+        ids, pairs_own, pairs_other = reachable_radars(reached, player)
+        if filename is None:
+            print(f'{player}: {len(np.unique(ids)) + 1} reachable radars')
+            report[player] = {'reachable_states': int(len(np.unique(ids)) + 1)}
+            continue
+        analysis, unvisited, states, greedy = analyse(player, ids, pairs_own, pairs_other, load_dense(filename))
+        print_analysis(analysis)
+        report[player] = analysis
+        if args.unvisited:
+            with open(f'{args.unvisited}_{player}.txt', 'w') as file:
+                file.writelines(f'{decode_state(state)}\n' for state in unvisited.tolist())
+        if args.policy:
+            with open(f'{args.policy}_{player}.csv', 'w') as file:
+                file.writelines(f'"{decode_state(state)}",{ACTIONS[action]}\n' for state, action in zip(states.tolist(), greedy.tolist()))
+        if args.heatmaps:
+            plot_heatmaps(analysis, args.heatmaps)
+    print(f'done in {time.perf_counter() - start:.2f}s')
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
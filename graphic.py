@@ -8,8 +8,10 @@ SPRITE_SIZE = 128
 SPRITE_SCALE = 1
 CHARACTER_SCALING = 2
 
-WINDOW_VELOCITY_MAX = 999_999
 WINDOW_VELOCITY_MIN = 20
+FRAME_RATE = 60
+FAST_FORWARD_STEPS = 1000
+MAX_STEPS_PER_FRAME = 100_000
 
 SCREEN_WIDTH = SPRITE_SIZE * GRID_LIMIT
 SCREEN_HEIGHT = 650
@@ -32,21 +34,27 @@ ANIMATIONS = {
 ANIMATIONS_LIST = list(ANIMATIONS.keys())
 
 
+def set_text(text, value):
+    # changing the text of an arcade.Text rebuilds its layout, skip it when nothing changed
+    if text.text != value:
+        text.text = value
+
+
 class Environment(LogicEnvironment):
-    def __init__(self, learning_rate, discount_factor, play_mode=False):
-        super().__init__(learning_rate, discount_factor)
+    def __init__(self, learning_rate, discount_factor, play_mode=False, qtable_backend=QTABLE_DICT):
+        super().__init__(learning_rate, discount_factor, qtable_backend)
         self.agents = {
-            KEN: Agent(self, KEN, learning_rate, discount_factor),
-            RYU: Agent(self, RYU, learning_rate, discount_factor)
+            KEN: Agent(self, KEN, learning_rate, discount_factor, qtable_backend, play_mode),
+            RYU: Agent(self, RYU, learning_rate, discount_factor, qtable_backend, play_mode)
         }
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
 
 
 class Agent(arcade.Sprite, LogicAgent):
-    def __init__(self, environment, player_name, learning_rate, discount_factor):
+    def __init__(self, environment, player_name, learning_rate, discount_factor, qtable_backend=QTABLE_DICT, play_mode=False):
         arcade.Sprite.__init__(self)
-        LogicAgent.__init__(self, environment, player_name, learning_rate, discount_factor, play_mode=False)
+        LogicAgent.__init__(self, environment, player_name, learning_rate, discount_factor, play_mode=play_mode, qtable_backend=qtable_backend)
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.cur_texture = 0
@@ -78,15 +86,30 @@ class Agent(arcade.Sprite, LogicAgent):
 
 
 class Graphic(arcade.Window, Game):
-    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, play_mode=False):
+    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, play_mode=False, qtable_backend=QTABLE_DICT):
         arcade.Window.__init__(self, SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-        Game.__init__(self, learning_rate, discount_factor, play_mode)
+        Game.__init__(self, learning_rate, discount_factor, play_mode, qtable_backend)
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.play_mode = play_mode
         self.gui_camera = None
         self.camera = None
         self.scene = None
+        self.steps_per_frame = 1
+        self.create_texts()
+
+    def create_texts(self):
+        def text(x, y, color=arcade.color.BLACK, size=20, bold=True):
+            return arcade.Text('', x, y, color, size, bold=bold)
+
+        self.top_right_texts = [text(SCREEN_WIDTH - 300, SCREEN_HEIGHT - SCREEN_HEIGHT_SPACER * (i+1)) for i in range(5)]
+        self.ryu_vitals_texts = [text(SCREEN_WIDTH - 400, 10 + i * SCREEN_HEIGHT_SPACER) for i in range(3)]
+        self.ken_vitals_texts = [text(10, 10 + i * SCREEN_HEIGHT_SPACER) for i in range(3)]
+        self.state_texts = [text(10, SCREEN_HEIGHT - (i+1) * SCREEN_HEIGHT_SPACER) for i in range(2)]
+        self.radar_texts = {
+            RYU: [text(0, 0, arcade.color.RED, 12, False) for _ in range(2 * RADAR_RADIUS)],
+            KEN: [text(0, 0, arcade.color.BLUE, 12, False) for _ in range(2 * RADAR_RADIUS)],
+        }
 
     def create_scene(self):
         self.scene = arcade.Scene()
@@ -100,15 +123,16 @@ class Graphic(arcade.Window, Game):
             self.wall_list.append(wall)
 
     def setup(self):
-        self.env = Environment(self.learning_rate, self.discount_factor, self.play_mode)
+        self.env = Environment(self.learning_rate, self.discount_factor, self.play_mode, self.qtable_backend)
+        self.seed_agents()
 
         self.Ken = self.env.agents[KEN]
         self.Ken.set_position()
-        self.Ken.load_qtable("KenQtable.qtable")
+        self.Ken.load_qtable(qtable_filename(KEN))
 
         self.Ryu = self.env.agents[RYU]
         self.Ryu.set_position()
-        self.Ryu.load_qtable("RyuQtable.qtable")
+        self.Ryu.load_qtable(qtable_filename(RYU))
 
         self.player_list = arcade.SpriteList()
         self.player_list.append(self.Ryu)
@@ -122,65 +146,64 @@ class Graphic(arcade.Window, Game):
             return 0
         return round(100 * wins / total_wins, 2)
 
+    def draw_text_list(self, texts, values):
+        for text, value in zip(texts, values):
+            set_text(text, value)
+            text.draw()
+
     def draw_top_right_texts(self):
-        to_print = [
+        self.draw_text_list(self.top_right_texts, [
             f'Ken win rate : {self.win_rate(self.ken_wins)} %',
             f'Ryu win rate : {self.win_rate(self.ryu_wins)} %',
             f'Iterations : {self.iterations}',
-            f'Total wins : {self.ryu_wins + self.ken_wins}'
-        ]
-        for i in range(len(to_print)):
-            arcade.draw_text(
-                to_print[i], SCREEN_WIDTH - 300, SCREEN_HEIGHT - SCREEN_HEIGHT_SPACER * (i+1), arcade.color.BLACK, 20, bold=True)
+            f'Total wins : {self.ryu_wins + self.ken_wins}',
+            f'Steps / frame : {self.steps_per_frame}',
+        ])
 
     def print_ryu_vitals(self):
-        to_print = [
+        self.draw_text_list(self.ryu_vitals_texts, [
             f'Ryu noise : {self.Ryu.noise}',
             f'Ryu Score: {self.Ryu.get_score()}',
             f'Ryu hp : {self.Ryu.health}',
-        ]
-        for i in range(len(to_print)):
-            arcade.draw_text(
-                to_print[i], SCREEN_WIDTH - 400, 10 + i * SCREEN_HEIGHT_SPACER, arcade.color.BLACK, 20, bold=True)
+        ])
 
     def print_ken_vitals(self):
-        to_print = [
+        self.draw_text_list(self.ken_vitals_texts, [
             f'Ken noise : {self.Ken.noise}',
             f'Ken Score: {self.Ken.get_score()}',
             f'Ken hp : {self.Ken.health}',
-        ]
-        for i in range(len(to_print)):
-            arcade.draw_text(
-                to_print[i], 10, 10 + i * SCREEN_HEIGHT_SPACER, arcade.color.BLACK, 20, bold=True)
+        ])
 
     def draw_texts(self):
         self.draw_top_right_texts()
         self.print_ryu_vitals()
         self.print_ken_vitals()
-        arcade.draw_text(
-            f'Ryu state : {self.Ryu.state} ', 10, SCREEN_HEIGHT - SCREEN_HEIGHT_SPACER, arcade.color.BLACK, 20, bold=True)
-        arcade.draw_text(
-            f'Ken state : {self.Ken.state} ', 10, SCREEN_HEIGHT - 2 * SCREEN_HEIGHT_SPACER, arcade.color.BLACK, 20, bold=True)
+        self.draw_text_list(self.state_texts, [
+            f'Ryu state : {self.Ryu.state} ',
+            f'Ken state : {self.Ken.state} ',
+        ])
 
     def draw_radars(self):
         self.draw_radar_of(RYU, arcade.color.RED)
         self.draw_radar_of(KEN, arcade.color.BLUE, SPRITE_SIZE/2 + 10)
 
     def draw_radar_of(self, player, color, height_offset=0):
-        agent = self.env.agents[player]
         radar = self.env.get_radar(player)
+        texts = iter(self.radar_texts[player])
 
         position = self.env.positions[player]
         center_x = position * SPRITE_SIZE + SPRITE_SIZE / 2
         center_y = SPRITE_SIZE + SPRITE_SIZE / 2
         y = center_y + height_offset
-        for i in range(-3, 4):
+        for i in range(-RADAR_RADIUS, RADAR_RADIUS + 1):
             if(i == 0) : continue
             x = center_x + SPRITE_SIZE * i
             arcade.draw_rectangle_outline(x, y, SPRITE_SIZE, SPRITE_SIZE/2, color)
-            arcade.draw_text(radar[3+i], x, y, color)
-
-        
+            text = next(texts)
+            set_text(text, radar[RADAR_RADIUS+i])
+            if text.position != (x, y):
+                text.position = (x, y)
+            text.draw()
 
     def on_draw(self):
         self.clear()
@@ -190,14 +213,19 @@ class Graphic(arcade.Window, Game):
         self.draw_radars()
 
     def on_update(self, delta_time: float):
-        player_start = super().round()
-        self.env.agents[player_start].set_position()
+        # fast-forward: the whole batch runs before the next frame, sprites only show where it ended
+        for _ in range(self.steps_per_frame):
+            super().round()
+            self.check_end_game()
+            if self.wins >= self.max_wins:
+                self.end_game()
+                exit(0)
+        self.Ryu.set_position()
+        self.Ken.set_position()
         self.player_list.update()
 
-        self.check_end_game()
-        if self.wins >= self.max_wins:
-            self.end_game()
-            exit(0)
+    def set_steps_per_frame(self, steps):
+        self.steps_per_frame = max(1, min(steps, MAX_STEPS_PER_FRAME))
 
     def on_key_press(self, key, modifiers):
         if key == arcade.key.Q:
@@ -206,9 +234,15 @@ class Graphic(arcade.Window, Game):
             self.Ryu.noise = NOISE
             self.Ken.noise = NOISE
         if key == arcade.key.M:
-            window.set_update_rate(1 / WINDOW_VELOCITY_MIN)
+            self.set_steps_per_frame(1)
+            self.set_update_rate(1 / WINDOW_VELOCITY_MIN)
         if key == arcade.key.P:
-            window.set_update_rate(1 / WINDOW_VELOCITY_MAX)
+            self.set_steps_per_frame(FAST_FORWARD_STEPS)
+            self.set_update_rate(1 / FRAME_RATE)
+        if key in (arcade.key.PLUS, arcade.key.EQUAL, arcade.key.NUM_ADD):
+            self.set_steps_per_frame(self.steps_per_frame * 2)
+        if key in (arcade.key.MINUS, arcade.key.NUM_SUBTRACT):
+            self.set_steps_per_frame(self.steps_per_frame // 2)
 
 
 if __name__ == '__main__':
@@ -216,6 +250,7 @@ if __name__ == '__main__':
     if len(sys.argv) == 2:
         play_mode = bool(sys.argv[1])
     window = Graphic(play_mode=play_mode)
-    window.set_update_rate(1 / WINDOW_VELOCITY_MAX)
+    window.set_steps_per_frame(FAST_FORWARD_STEPS)
+    window.set_update_rate(1 / FRAME_RATE)
     window.setup()
     window.run()
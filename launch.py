@@ -1,9 +1,147 @@
-from subprocess import Popen
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib import import_module
+from itertools import product
+
+from convergence import (CONVERGENCE_DELTA, CONVERGENCE_EVERY, CONVERGENCE_PATIENCE, CONVERGENCE_POLICY,
+                         CONVERGENCE_WIN_RATE, ConvergenceMonitor, parse_threshold)
+from logic import MAX_WIN, QTABLE_BACKENDS, QTABLE_DICT
 
 LEARNING_RATES = (40, 80)  # 90
 DISCOUNT_FACTORS = (20, 80)  # 90
+NOISES = (0, 0)
+STEP = 5
+SUMMARY_FILE = "sweep.jsonl"
+
+
+def parse_range(value):
+    bounds = [float(v) for v in value.split(':')]
+    if len(bounds) == 1:
+        return bounds[0], bounds[0]
+    return bounds[0], bounds[1]
+
+
+def grid_values(bounds, step):
+    values = []
+    value = bounds[0]
+    while value <= bounds[1] + 1e-9:
+        values.append(round(value, 6))
+        value += step
+    return values
+
+
+def grid_points(learning_rates, discount_factors, noises, step):
+    return list(product(grid_values(learning_rates, step), grid_values(discount_factors, step), grid_values(noises, step)))
+
+
+def random_points(learning_rates, discount_factors, noises, count, seed=None):
+    rng = random.Random(seed)
+    return [tuple(round(rng.uniform(*bounds), 2) for bounds in (learning_rates, discount_factors, noises))
+            for _ in range(count)]
+
+
+def point_key(learning_rate, discount_factor, noise):
+    return f'{learning_rate:g}_{discount_factor:g}_{noise:g}'
+
+
+def load_done(summary_file):
+    done = set()
+    if os.path.exists(summary_file):
+        with open(summary_file) as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    done.add(point_key(result['learning_rate'], result['discount_factor'], result['noise']))
+    return done
+
+
+def train(learning_rate, discount_factor, noise, max_wins, qtable_backend, save_dir=None, seed=None, convergence=None):
+    # convergence: ConvergenceMonitor arguments, the point stops early once its qtables settle
+    NonGraphic = import_module('no-graphic').NonGraphic
+    key = point_key(learning_rate, discount_factor, noise)
+    metrics_file = os.path.join(save_dir, f'metrics_{key}.csv') if save_dir is not None else None
+    game = NonGraphic(learning_rate / 100.0, discount_factor / 100.0, qtable_backend, noise / 100.0, metrics_file, seed)
+    game.max_wins = max_wins
+    if convergence is not None:
+        game.convergence = ConvergenceMonitor(**convergence)
+    game.setup()
+    start = time.perf_counter()
+    game.train()
+    elapsed = time.perf_counter() - start
+    game.metrics.close()
+    if save_dir is not None:
+        game.Ryu.save(os.path.join(save_dir, f'Ryu_{key}.qtable'))
+        game.Ken.save(os.path.join(save_dir, f'Ken_{key}.qtable'))
+    last = game.metrics.last or {}
+    report = game.convergence.report() if game.convergence is not None else {}
+    return {
+        'learning_rate': learning_rate,
+        'discount_factor': discount_factor,
+        'noise': noise,
+        'wins': game.wins,
+        'ryu_wins': game.ryu_wins,
+        'ken_wins': game.ken_wins,
+        'iterations': game.iterations,
+        'ryu_score': last.get('ryu_score', game.Ryu.get_score()),
+        'ken_score': last.get('ken_score', game.Ken.get_score()),
+        'ryu_qtable_size': len(game.Ryu.qtable),
+        'ken_qtable_size': len(game.Ken.qtable),
+        'elapsed': elapsed,
+        'steps_per_sec': game.iterations / elapsed if elapsed > 0 else 0,
+        **game.metrics.summary(),
+        **report,
+    }
+
+
+def sweep(points, max_wins=MAX_WIN, workers=None, summary_file=SUMMARY_FILE, qtable_backend=QTABLE_DICT, save_dir=None, seed=None, convergence=None):
+    done = load_done(summary_file)
+    todo = [point for point in points if point_key(*point) not in done]
+    print(f'{len(points) - len(todo)} points already done, {len(todo)} to run')
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(train, *point, max_wins, qtable_backend, save_dir, seed, convergence) for point in todo]
+        with open(summary_file, 'a') as summary:
+            for future in as_completed(futures):
+                result = future.result()
+                summary.write(json.dumps(result) + '\n')
+                summary.flush()
+                print(f"lr {result['learning_rate']} df {result['discount_factor']} noise {result['noise']}: "
+                      f"Ryu {result['ryu_wins']} / Ken {result['ken_wins']} ({result['steps_per_sec']:.0f} steps/s)"
+                      f"{' converged' if result.get('converged') else ''}")
+
 
-for learning_rate in range(LEARNING_RATES[0], LEARNING_RATES[1] + 1, 5):
-    for discount_factor in range(DISCOUNT_FACTORS[0], DISCOUNT_FACTORS[1] + 1, 5):
-        Popen(f"python3 no-graphic.py {learning_rate} {discount_factor}", shell=True)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep over no-graphic trainings')
+    parser.add_argument('--learning-rates', type=parse_range, default=LEARNING_RATES, help='min:max in percent')
+    parser.add_argument('--discount-factors', type=parse_range, default=DISCOUNT_FACTORS, help='min:max in percent')
+    parser.add_argument('--noises', type=parse_range, default=NOISES, help='min:max in percent')
+    parser.add_argument('--step', type=float, default=STEP, help='grid step in percent')
+    parser.add_argument('--random', type=int, help='sample this many random points instead of the grid')
+    parser.add_argument('--seed', type=int, help='seeds the random points and every training')
+    parser.add_argument('--wins', type=int, default=MAX_WIN, help='fights per training')
+    parser.add_argument('--workers', type=int, help='parallel trainings, defaults to the cpu count')
+    parser.add_argument('--summary', default=SUMMARY_FILE, help='results file, completed points are skipped on rerun')
+    parser.add_argument('--save-dir', help='save both qtables of every point in this directory')
+    parser.add_argument('--qtable', choices=QTABLE_BACKENDS, default=QTABLE_DICT)
+    parser.add_argument('--converge', action='store_true', help='stop each training once its qtables stop changing')
+    parser.add_argument('--converge-every', type=int, default=CONVERGENCE_EVERY)
+    parser.add_argument('--max-delta', type=parse_threshold, default=CONVERGENCE_DELTA)
+    parser.add_argument('--policy-change', type=parse_threshold, default=CONVERGENCE_POLICY)
+    parser.add_argument('--win-rate-band', type=parse_threshold, default=CONVERGENCE_WIN_RATE)
+    parser.add_argument('--patience', type=int, default=CONVERGENCE_PATIENCE)
+    args = parser.parse_args()
+    convergence = None
+    if args.converge:
+        convergence = {'every': args.converge_every, 'max_delta': args.max_delta, 'policy_change': args.policy_change,
+                       'win_rate': args.win_rate_band, 'patience': args.patience}
 
+    if args.random:
+        points = random_points(args.learning_rates, args.discount_factors, args.noises, args.random, args.seed)
+    else:
+        points = grid_points(args.learning_rates, args.discount_factors, args.noises, args.step)
+    sweep(points, args.wins, args.workers, args.summary, args.qtable, args.save_dir, args.seed, convergence)
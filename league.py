@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib import import_module
+from random import Random
+
+from logic import DISCOUNT_FACTOR, KEN, LEARNING_RATE, QTABLE_DENSE, RYU
+from parallel import SharedTraining
+from qtable import save_table
+
+LEAGUE_SIZE = 8
+LEAGUE_ROUNDS = 20
+MATCH_FIGHTS = 200
+ELO_START = 1500
+ELO_K = 32
+SAMPLING_UNIFORM, SAMPLING_ELO = 'uniform', 'elo'
+SAMPLINGS = [SAMPLING_UNIFORM, SAMPLING_ELO]
+LEAGUE_FILE = "league.json"
+
+# population store of the pool worker, mapped once per process by attach_store
+STORE = None
+
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def pick_opponent(fighter, ratings, sampling, rng):
+    # elo sampling favours opponents the fighter beats about half of the time, those matches teach it the most
+    opponents = [other for other in range(len(ratings)) if other != fighter]
+    if sampling == SAMPLING_UNIFORM:
+        return rng.choice(opponents)
+    weights = []
+    for other in opponents:
+        expected = expected_score(ratings[fighter], ratings[other])
+        weights.append(expected * (1 - expected))
+    return rng.choices(opponents, weights)[0]
+
+
+def attach_store(names, fighters):
+    global STORE
+    STORE = SharedTraining.attach(names, fighters)
+
+
+def play_match(ryu, ken, fights, noise, learning_rate, discount_factor, seed):
+    # both fighters learn in their shared table while other matches update them too (hogwild)
+    game = import_module('no-graphic').NonGraphic(learning_rate, discount_factor, QTABLE_DENSE, seed=seed)
+    game.setup()
+    game.max_wins = fights
+    for player, fighter in [(RYU, ryu), (KEN, ken)]:
+        agent = game.env.agents[player]
+        agent.qtable = STORE.table(fighter)
+        agent.noise = noise[player]
+    game.train()
+    game.metrics.close()
+    return {'ryu': ryu, 'ken': ken, 'ryu_wins': game.ryu_wins, 'ken_wins': game.ken_wins, 'iterations': game.iterations,
+            'start_noise': noise, 'noise': {RYU: game.Ryu.noise, KEN: game.Ken.noise}}
+
+
+def update_ratings(ratings, matches):
+    # every match of a round is rated against the ratings the round started with, whatever order they finish in
+    changes = [0.0] * len(ratings)
+    for match in matches:
+        fights = match['ryu_wins'] + match['ken_wins']
+        if fights == 0:
+            continue
+        ryu, ken = match['ryu'], match['ken']
+        change = ELO_K * (match['ryu_wins'] / fights - expected_score(ratings[ryu], ratings[ken]))
+        changes[ryu] += change
+        changes[ken] -= change
+    return [rating + change for rating, change in zip(ratings, changes)]
+
+
+def train(fighters=LEAGUE_SIZE, rounds=LEAGUE_ROUNDS, fights=MATCH_FIGHTS, sampling=SAMPLING_ELO, workers=None,
+          learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, noise=0, seed=None, save_dir=None):
+    # every round each fighter plays one match against a sampled opponent, so it also plays the matches
+    # where others picked it: all matches of a round run at the same time in the pool
+    rng = Random(seed)
+    store = SharedTraining.create(noise, fighters)
+    ratings = [float(ELO_START)] * fighters
+    history = []
+    iterations = 0
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=attach_store,
+                                 initargs=(store.names(), fighters)) as pool:
+            for league_round in range(rounds):
+                futures = []
+                for fighter in range(fighters):
+                    pairing = [fighter, pick_opponent(fighter, ratings, sampling, rng)]
+                    # sides are drawn so that no fighter only learns one starting position
+                    rng.shuffle(pairing)
+                    ryu, ken = pairing
+                    futures.append(pool.submit(play_match, ryu, ken, fights,
+                                               {RYU: float(store.noise[ryu]), KEN: float(store.noise[ken])},
+                                               learning_rate, discount_factor, rng.getrandbits(64)))
+                matches = []
+                for future in as_completed(futures):
+                    match = future.result()
+                    matches.append(match)
+                    iterations += match['iterations']
+                    # each match applies its own exploration decay to the fighter's shared noise
+                    for player in [RYU, KEN]:
+                        if match['start_noise'][player] > 0:
+                            store.noise[match[player.lower()]] *= match['noise'][player] / match['start_noise'][player]
+                ratings = update_ratings(ratings, matches)
+                history.append({'round': league_round + 1, 'ratings': ratings,
+                                'matches': [(match['ryu'], match['ken'], match['ryu_wins'], match['ken_wins'])
+                                            for match in matches]})
+                print(f'round {league_round + 1}: ' + ' '.join(f'{rating:.0f}' for rating in ratings))
+        elapsed = time.perf_counter() - start
+        if save_dir is not None:
+            os.makedirs(save_dir, exist_ok=True)
+            for fighter in range(fighters):
+                save_table(store.table(fighter), os.path.join(save_dir, f'fighter_{fighter}.qtable'))
+        sizes = [int(store.visited[fighter].sum()) for fighter in range(fighters)]
+    finally:
+        store.close()
+    return {'fighters': fighters, 'sampling': sampling, 'fights_per_match': fights, 'ratings': ratings,
+            'qtable_sizes': sizes, 'iterations': iterations, 'elapsed': elapsed,
+            'steps_per_sec': iterations / elapsed if elapsed > 0 else 0, 'history': history}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train a population of qtables against each other, rated with Elo')
+    parser.add_argument('--fighters', type=int, default=LEAGUE_SIZE, help='population size')
+    parser.add_argument('--rounds', type=int, default=LEAGUE_ROUNDS)
+    parser.add_argument('--fights', type=int, default=MATCH_FIGHTS, help='fights per match')
+    parser.add_argument('--sampling', choices=SAMPLINGS, default=SAMPLING_ELO, help='how each fighter picks its opponent')
+    parser.add_argument('--workers', type=int, help='parallel matches, defaults to the cpu count')
+    parser.add_argument('--learning-rate', type=float, default=LEARNING_RATE * 100, help='in percent')
+    parser.add_argument('--discount-factor', type=float, default=DISCOUNT_FACTOR * 100, help='in percent')
+    parser.add_argument('--noise', type=float, default=0, help='initial exploration rate of every fighter')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--save-dir', help='save the qtable of every fighter in this directory')
+    parser.add_argument('--output', default=LEAGUE_FILE, help='ratings over time as json')
+    args = parser.parse_args()
+    if args.fighters < 2:
+        parser.error('a league needs at least 2 fighters')
+    results = train(args.fighters, args.rounds, args.fights, args.sampling, args.workers, args.learning_rate / 100.0,
+                    args.discount_factor / 100.0, args.noise, args.seed, args.save_dir)
+    print(f"{results['iterations']} steps in {results['elapsed']:.1f}s ({results['steps_per_sec']:.0f} steps/s)")
+    for fighter in sorted(range(args.fighters), key=lambda fighter: -results['ratings'][fighter]):
+        print(f"fighter {fighter}: {results['ratings'][fighter]:.0f} ({results['qtable_sizes'][fighter]} states)")
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
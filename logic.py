@@ -1,22 +1,37 @@
 import pickle
 from os.path import exists
 
-from matplotlib import pyplot as plt
-from random import random, choice
+from bisect import bisect_left
+from itertools import chain
+from random import Random
+
+from metrics import TrainingMetrics
 
 LEARNING_RATE = 0.8
 DISCOUNT_FACTOR = 0.8
 NOISE = 1
 MAX_WIN = 100_000
+RANDOM_BLOCK = 4096
+HISTORY_LENGTH = 3
+HISTORY_CACHE = 1 << 16
+REPLAY_CAPACITY = 100_000
+REPLAY_BATCH = 64
+REPLAY_EVERY = 16
+
+QTABLE_DICT, QTABLE_DENSE, QTABLE_SPARSE, QTABLE_MAPPED = 'dict', 'dense', 'sparse', 'mapped'
+QTABLE_BACKENDS = [QTABLE_DICT, QTABLE_DENSE, QTABLE_SPARSE]
+QTABLE_BINARY_EXTENSION = '.qtb'
 
 RYU = "Ryu"
 KEN = "Ken"
 PLAYERS = [RYU, KEN]
+OPPONENTS = {RYU: KEN, KEN: RYU}
 
 ACTION_LEFT, ACTION_RIGHT, ACTION_JUMP, ACTION_CROUCH, ACTION_DODGE, ACTION_NONE = 'L', 'R', 'J', 'C', 'D', 'N'
 ACTION_PUNCH, ACTION_HIGH_PUNCH, ACTION_LOW_PUNCH, ACTION_LOW_KICK, ACTION_HIGH_KICK = 'P', 'HP', 'LP', 'LK', 'HK'
 ACTIONS = [ACTION_NONE, ACTION_DODGE, ACTION_JUMP, ACTION_CROUCH, ACTION_PUNCH,
            ACTION_LOW_KICK, ACTION_HIGH_KICK, ACTION_LEFT, ACTION_RIGHT]
+ACTION_INDEXES = {action: i for i, action in enumerate(ACTIONS)}
 ATTACKS = [ACTION_PUNCH, ACTION_HIGH_PUNCH, ACTION_LOW_PUNCH, ACTION_LOW_KICK, ACTION_HIGH_KICK]
 
 ORIENTATION_LEFT, ORIENTATION_RIGHT = -1, 1
@@ -67,6 +82,12 @@ WALL = '#'
 GRID_LIMIT = 10
 KEN_START = 2
 RYU_START = 6
+RADAR_RADIUS = 3
+BUCKETING_LINEAR, BUCKETING_LOG = 'linear', 'log'
+BUCKETINGS = [BUCKETING_LINEAR, BUCKETING_LOG]
+# arenas up to this width precompute the radar cells of every pair of positions, wider ones cache them
+PREFIX_TABLE_WIDTH = 128
+PREFIX_CACHE = 1 << 16
 
 
 def distance_to_range(distance):
@@ -80,22 +101,163 @@ def distance_to_range(distance):
         return DISTANCE_FAR
 
 
+def radar_slots(player_position, opponent_position, opponent_stance):
+    return ARENA.radar_slots(player_position, opponent_position, opponent_stance)
+
+
+def bucket_bounds(radius, bucketing=BUCKETING_LINEAR):
+    # a distance lands on the radar slot given by the number of bounds below it, the last slot holds everything
+    # farther. Bounds always start with 0 and 1: only an adjacent wall or opponent is next to the player,
+    # which blocked moves and hits rely on. Log buckets double the distances covered by each further slot
+    if bucketing == BUCKETING_LOG:
+        return (0, 1) + tuple(2 ** i for i in range(1, radius - 1))
+    if bucketing != BUCKETING_LINEAR:
+        raise ValueError(f'Unknown bucketing: {bucketing}')
+    return tuple(range(radius))
+
+
 def arg_max(table):
     return max(table, key=table.get)
 
 
+def new_qtable(backend):
+    if backend == QTABLE_DENSE:
+        from qtable import DenseQTable
+        return DenseQTable()
+    if backend == QTABLE_SPARSE:
+        from sparse import SparseQTable
+        return SparseQTable()
+    if backend != QTABLE_DICT:
+        raise ValueError(f'Unknown qtable backend: {backend}')
+    return {}
+
+
+def qtable_filename(player):
+    binary = f'{player}Qtable{QTABLE_BINARY_EXTENSION}'
+    return binary if exists(binary) else f'{player}Qtable.qtable'
+
+
 def sign(x):
     return 1 if x > 0 else -1 if x < 0 else 0
 
 
+def random_blocks(draw_block):
+    # draws are generated RANDOM_BLOCK at a time and handed out by a single C-level iterator,
+    # cheaper per step than a random.choice call
+    return chain.from_iterable(iter(draw_block, None))
+
+
+class ActionHistories(dict):
+    # an agent's last actions are packed in one int, most recent in the lowest base-len(ACTIONS) digit;
+    # code -> (actions kept, actions shown on the opponent radar) tuples, decoded once per code
+    def __init__(self, length):
+        super().__init__()
+        self.length = length
+        # the stance reset looks at the action before last, whatever the radar shows
+        self.kept = max(length, 2)
+        self.states = len(ACTIONS) ** self.kept
+
+    def __missing__(self, code):
+        if len(self) >= HISTORY_CACHE:
+            # long histories rarely repeat, keep the decoded ones bounded
+            self.clear()
+        actions, rest = [], code
+        for _ in range(self.kept):
+            rest, action = divmod(rest, len(ACTIONS))
+            actions.append(ACTIONS[action])
+        actions = tuple(actions)
+        entry = self[code] = actions, actions[:self.length]
+        return entry
+
+    def encode(self, actions):
+        code = 0
+        for action in reversed(actions[:self.kept]):
+            code = code * len(ACTIONS) + ACTION_INDEXES[action]
+        return code
+
+
+HISTORIES = {}
+
+
+def action_histories(length):
+    if length not in HISTORIES:
+        HISTORIES[length] = ActionHistories(length)
+    return HISTORIES[length]
+
+
+class Arena:
+    # the radar only sees bucketed distances to the walls and the opponent within `radius` slots on each side,
+    # so the number of radar layouts, hence of qtable states, does not grow with the width
+    def __init__(self, width=GRID_LIMIT, radius=RADAR_RADIUS, bucketing=BUCKETING_LINEAR):
+        if radius < 2:
+            raise ValueError('The radar needs a radius of at least 2')
+        if width < 8:
+            raise ValueError('The arena needs at least 8 cells')
+        self.width = width
+        self.radius = radius
+        self.bucketing = bucketing
+        self.bounds = bucket_bounds(radius, bucketing)
+        self.cells = 2 * radius + 1
+        self.left_wall, self.right_wall = 0, width - 1
+        # fighters start 4 cells apart around the middle, KEN_START and RYU_START in the default arena
+        self.ken_start, self.ryu_start = width // 2 - 3, width // 2 + 1
+        self.offsets = [bisect_left(self.bounds, distance) for distance in range(width)]
+        self.layouts = {}
+        self.prefix_cache = {}
+        # radar cells only depend on both positions and the opponent stance: prefixes[player][opponent][stance]
+        self.prefixes = None
+        if width <= PREFIX_TABLE_WIDTH:
+            self.prefixes = [[{stance: self.layout(player_position, opponent_position, stance) for stance in STANCES}
+                              for opponent_position in range(width)]
+                             for player_position in range(width)]
+
+    def is_default(self):
+        return self.width == GRID_LIMIT and self.bounds == bucket_bounds(RADAR_RADIUS)
+
+    def radar_slots(self, player_position, opponent_position, opponent_stance):
+        slots = ['_'] * self.cells
+        offsets, center = self.offsets, self.radius
+        slots[center - offsets[player_position - self.left_wall]] = WALL
+        slots[center + offsets[self.right_wall - player_position]] = WALL
+        slots[center + sign(opponent_position - player_position) * offsets[abs(opponent_position - player_position)]] = opponent_stance
+        return slots
+
+    def layout(self, player_position, opponent_position, opponent_stance):
+        # positions with the same layout share one tuple
+        slots = tuple(self.radar_slots(player_position, opponent_position, opponent_stance))
+        return self.layouts.setdefault(slots, slots)
+
+    def prefix(self, player_position, opponent_position, opponent_stance):
+        key = player_position, opponent_position, opponent_stance
+        prefix = self.prefix_cache.get(key)
+        if prefix is None:
+            if len(self.prefix_cache) >= PREFIX_CACHE:
+                self.prefix_cache.clear()
+            prefix = self.prefix_cache[key] = self.layout(player_position, opponent_position, opponent_stance)
+        return prefix
+
+
+ARENA = Arena()
+
+
 class LogicEnvironment:
+    # the default arena, transitions.py and batch.py are built on it
     LEFT_WALL = 0
     RIGHT_WALL = GRID_LIMIT - 1
 
-    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR):
+    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, qtable_backend=QTABLE_DICT, history_length=HISTORY_LENGTH, arena=None):
+        self.arena = arena = arena or ARENA
+        if qtable_backend == QTABLE_DENSE and not arena.is_default():
+            raise ValueError(f'The dense qtable encodes the default {GRID_LIMIT} cells arena and radar only')
+        self.radar_center = arena.radius
+        self.radar_prefixes = arena.prefixes
+        if arena.prefixes is None:
+            self.radar_prefix = self.cached_radar_prefix
+        self.qtable_backend = qtable_backend
+        self.history_length = history_length
         self.positions = {
-            RYU: RYU_START,
-            KEN: KEN_START,
+            RYU: arena.ryu_start,
+            KEN: arena.ken_start,
         }
         self.orientations = {
             RYU: ORIENTATION_RIGHT,
@@ -106,18 +268,22 @@ class LogicEnvironment:
             KEN: STANCE_STANDING,
         }
         self.radars = {
-            RYU: tuple(['_'] * 12),
-            KEN: tuple(['_'] * 12),
+            RYU: ('_',) * (arena.cells + 2 + history_length),
+            KEN: ('_',) * (arena.cells + 2 + history_length),
+        }
+        self.dirty_radars = {
+            RYU: True,
+            KEN: True,
         }
         self.agents = {
-            RYU: LogicAgent(self, RYU, learning_rate, discount_factor),
-            KEN: LogicAgent(self, KEN, learning_rate, discount_factor),
+            RYU: LogicAgent(self, RYU, learning_rate, discount_factor, qtable_backend=qtable_backend, history_length=history_length),
+            KEN: LogicAgent(self, KEN, learning_rate, discount_factor, qtable_backend=qtable_backend, history_length=history_length),
         }
 
     def reset(self):
         self.positions = {
-            KEN: KEN_START,
-            RYU: RYU_START,
+            KEN: self.arena.ken_start,
+            RYU: self.arena.ryu_start,
         }
         self.orientations = {
             RYU: ORIENTATION_RIGHT,
@@ -127,10 +293,7 @@ class LogicEnvironment:
             RYU: STANCE_STANDING,
             KEN: STANCE_STANDING,
         }
-        self.radars = {
-            RYU: self.get_radar(RYU),
-            KEN: self.get_radar(KEN),
-        }
+        self.invalidate_radars()
         self.agents[KEN].reset()
         self.agents[RYU].reset()
 
@@ -140,33 +303,39 @@ class LogicEnvironment:
             return RYU
         return KEN
 
-    def get_radar(self, player):
-        radar = ['_'] * 12
-        radar[7] = self.orientations[player]
-        radar[8] = self.stances[player]
+    def invalidate_radars(self, *players):
+        for player in players or PLAYERS:
+            self.dirty_radars[player] = True
+
+    def radar_prefix(self, player):
         opponent = self.opponent(player)
-        player_position = self.positions[player]
-        distance_opponent = self.distance_between_players()
-        orientation_to_opponent = sign(self.positions[opponent] - player_position)
-        range_left_wall = distance_to_range(player_position)
-        range_right_wall = distance_to_range(self.RIGHT_WALL - player_position)
-        radar[3 - DISTANCES[range_left_wall]] = WALL  # todo refacto ?
-        radar[3 + DISTANCES[range_right_wall]] = WALL
-        radar[3 + orientation_to_opponent * DISTANCES[distance_opponent]] = self.stances[opponent]
-        for i in range(3):
-            radar[9 + i] = self.opponent_previous_actions(player)[i]
-        return tuple(radar)
+        return self.radar_prefixes[self.positions[player]][self.positions[opponent]][self.stances[opponent]]
+
+    def cached_radar_prefix(self, player):
+        opponent = OPPONENTS[player]
+        return self.arena.prefix(self.positions[player], self.positions[opponent], self.stances[opponent])
+
+    def get_radar(self, player):
+        if self.dirty_radars[player]:
+            self.radars[player] = (self.radar_prefix(player) + (self.orientations[player], self.stances[player])
+                                   + self.agents[OPPONENTS[player]].history)
+            self.dirty_radars[player] = False
+        return self.radars[player]
 
     def distance_between_players(self):
         return distance_to_range(abs(self.positions[RYU] - self.positions[KEN]))
 
     def player_move(self, player, move):
-        radar = self.get_radar(player)
-        move_delta, self.orientations[player] = MOVES[move]
+        radar = self.radar_prefix(player)
+        move_delta, orientation = MOVES[move]
+        if orientation != self.orientations[player]:
+            self.orientations[player] = orientation
+            self.invalidate_radars(player)
         self.agents[player].orientation = self.orientations[player]
-        if radar[3 + move_delta] == WALL:
+        if radar[self.radar_center + move_delta] == WALL:
             return REWARD_NONE
         self.positions[player] += move_delta
+        self.invalidate_radars()
         return REWARD_NONE
 
     def is_within_range(self, attacker, attack):
@@ -174,8 +343,7 @@ class LogicEnvironment:
         opponent_stance = self.stances[self.opponent(attacker)]
         if attack not in STANCE_HIT_MAP[player_stance][opponent_stance]:
             return False
-        radar = self.get_radar(attacker)
-        target = radar[3 + self.orientations[attacker]]
+        target = self.radar_prefix(attacker)[self.radar_center + self.orientations[attacker]]
         return target != WALL and target != '_'
 
     def reset_player_stance(self, player):
@@ -184,6 +352,7 @@ class LogicEnvironment:
         previous_action = self.agents[player].previous_actions[1]
         if previous_action == ACTION_JUMP or previous_action == ACTION_CROUCH:
             self.stances[player] = STANCE_STANDING
+            self.invalidate_radars()
 
     def do(self, player):
         reward = 0
@@ -194,7 +363,9 @@ class LogicEnvironment:
             reward += self.player_move(player, action)
 
         if action in STANCE_CHANGES:
-            self.stances[player] = STANCE_CHANGES[action]
+            if self.stances[player] != STANCE_CHANGES[action]:
+                self.stances[player] = STANCE_CHANGES[action]
+                self.invalidate_radars()
             reward += REWARD_NONE
 
         if action in ATTACKS:
@@ -212,6 +383,34 @@ class LogicEnvironment:
 
         return reward, self.get_radar(player)
 
+    def use_transition_table(self):
+        if not self.arena.is_default():
+            raise ValueError(f'The transition table covers the default {GRID_LIMIT} cells arena only')
+        from transitions import TRANSITIONS
+        self.transitions = TRANSITIONS
+        self.do = self.table_do
+
+    def table_do(self, player):
+        # same outcome as do, resolved by one lookup in the precomputed transitions
+        opponent = OPPONENTS[player]
+        agent = self.agents[player]
+        positions, orientations, stances = self.positions, self.orientations, self.stances
+        position, orientation, stance = positions[player], orientations[player], stances[player]
+        new_position, new_orientation, new_stance, reward, hit = self.transitions[
+            position, positions[opponent], orientation, stance, stances[opponent],
+            agent.previous_actions[1] in STANCE_CHANGES, agent.current_action]
+        if new_orientation != orientation:
+            orientations[player] = new_orientation
+            agent.orientation = new_orientation
+            self.dirty_radars[player] = True
+        if new_position != position or new_stance != stance:
+            positions[player] = new_position
+            stances[player] = new_stance
+            self.invalidate_radars()
+        if hit:
+            self.inflict_damage_to(opponent)
+        return reward, self.get_radar(player)
+
     def opponent_previous_actions(self, player):
         opponent = self.opponent(player)
         if self.agents[opponent] == {}:
@@ -223,7 +422,9 @@ class LogicEnvironment:
 
 
 class LogicAgent:
-    def __init__(self, environment, player_name, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, noise=0, play_mode=False):
+    def __init__(self, environment, player_name, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, noise=0, play_mode=False, qtable_backend=QTABLE_DICT, history_length=HISTORY_LENGTH):
+        if qtable_backend == QTABLE_DENSE and history_length != HISTORY_LENGTH:
+            raise ValueError(f'The dense qtable encodes exactly {HISTORY_LENGTH} opponent actions')
         self.noise = noise
         self.play_mode = play_mode
         self.orientation = environment.orientations[player_name]
@@ -233,18 +434,43 @@ class LogicAgent:
         self.state = environment.radars[player_name]
         self.stance = STANCE_STANDING
         self.previous_state = self.state
-        self.previous_actions = [ACTION_NONE, ACTION_NONE, ACTION_NONE]
+        self.histories = action_histories(history_length)
+        self.set_previous_actions([ACTION_NONE] * self.histories.kept)
         self.current_action = ACTION_NONE
         self.player_name = player_name
         self.health = 100
-        self.qtable = {}
+        self.qtable_backend = qtable_backend
+        self.qtable = new_qtable(qtable_backend)
         self.score = 0
+        self.replay = None
+        self.visits = None
+        self.seed(None)
+
+    def seed(self, seed):
+        self.rng = Random(seed)
+        self.exploration_actions = random_blocks(lambda: self.rng.choices(ACTIONS, k=RANDOM_BLOCK))
 
     def load_qtable(self, filename):
-        if exists(filename):
+        if not exists(filename):
+            return
+        if filename.endswith(QTABLE_BINARY_EXTENSION):
+            from qtable import MappedQTable
+            self.qtable = MappedQTable(filename)
+            if self.play_mode:
+                self.qtable_backend = QTABLE_MAPPED
+                self.reset()
+                return
+            self.qtable = self.qtable.to_dict()
+        else:
             with open(filename, 'rb') as file:
                 self.qtable = pickle.load(file)
-            self.reset()
+        if self.qtable_backend == QTABLE_DENSE:
+            from qtable import DenseQTable
+            self.qtable = DenseQTable.from_dict(self.qtable)
+        elif self.qtable_backend == QTABLE_SPARSE:
+            from sparse import SparseQTable
+            self.qtable = SparseQTable.from_dict(self.qtable)
+        self.reset()
 
     def print_qtable(self):
         print('---' + self.player_name + ' QTABLE ---')
@@ -267,9 +493,12 @@ class LogicAgent:
         self.score = 0
 
     def choose_action(self):
-        if random() < self.noise:
+        if self.noise and self.rng.random() < self.noise:
             self.noise *= 0.9999
-            self.current_action = choice(ACTIONS)
+            self.current_action = next(self.exploration_actions)
+            return
+        if self.qtable_backend != QTABLE_DICT:
+            self.current_action = self.qtable.best_action(self.state)
             return
         self.add_qtable_state(self.state)
         self.current_action = arg_max(self.qtable[self.state])
@@ -280,8 +509,50 @@ class LogicAgent:
             for a in ACTIONS:
                 self.qtable[state][a] = 0.0
 
-    def update_qtable(self, reward, prev_state, new_state):
-        if not self.play_mode:
+    def use_replay(self, capacity, batch_size, every, prioritized=False):
+        if self.qtable_backend != QTABLE_DENSE:
+            raise ValueError('Experience replay needs the dense qtable backend')
+        from replay import ReplayBuffer
+        self.replay = ReplayBuffer(capacity, batch_size, every, prioritized, self.rng.getrandbits(64))
+
+    def use_symmetry(self):
+        # the qtable keeps one state of each mirrored pair, the other one reads it with left and right swapped
+        from compact import MIRRORED_ACTIONS, CanonicalStates
+        self.canonical_states = CanonicalStates(self.env.arena.cells)
+        self.mirrored_actions = MIRRORED_ACTIONS
+        self.choose_action = self.choose_symmetric_action
+        self.update_qtable = self.update_symmetric_qtable
+
+    def choose_symmetric_action(self):
+        state = self.state
+        self.state, mirrored = self.canonical_states[state]
+        LogicAgent.choose_action(self)
+        self.state = state
+        if mirrored:
+            self.current_action = self.mirrored_actions[self.current_action]
+
+    def update_symmetric_qtable(self, reward, prev_state, new_state, done=False):
+        prev_state, mirrored = self.canonical_states[prev_state]
+        action = self.current_action
+        if mirrored:
+            self.current_action = self.mirrored_actions[action]
+        LogicAgent.update_qtable(self, reward, prev_state, self.canonical_states[new_state][0], done)
+        self.current_action = action
+
+    def update_qtable(self, reward, prev_state, new_state, done=False):
+        if self.play_mode:
+            return
+        if self.visits is not None:
+            self.visits[prev_state] = self.visits.get(prev_state, 0) + 1
+        if self.replay is not None:
+            # transitions are only stored, the qtable learns from the replayed minibatches
+            due = self.replay.add(self.qtable.add_state(prev_state), ACTION_INDEXES[self.current_action], reward,
+                                  self.qtable.add_state(new_state), done)
+            if due:
+                self.replay.train(self.qtable.values, self.learning_rate, self.discount_factor)
+        elif self.qtable_backend != QTABLE_DICT:
+            self.qtable.update(prev_state, self.current_action, reward, new_state, self.learning_rate, self.discount_factor)
+        else:
             self.add_qtable_state(prev_state)
             self.add_qtable_state(new_state)
             max_q = max(self.qtable[new_state].values())
@@ -298,9 +569,14 @@ class LogicAgent:
         self.state = new_state
         return self.current_action
 
+    def set_previous_actions(self, actions):
+        self.history_code = self.histories.encode(actions)
+        self.previous_actions, self.history = self.histories[self.history_code]
+
     def push_previous_action(self):
-        self.previous_actions.pop()
-        self.previous_actions.insert(0, self.current_action)
+        self.history_code = code = (self.history_code * len(ACTIONS) + ACTION_INDEXES[self.current_action]) % self.histories.states
+        self.previous_actions, self.history = self.histories[code]
+        self.env.invalidate_radars(OPPONENTS[self.player_name])
 
     def get_hit(self):
         self.health -= HIT_DAMAGE
@@ -316,24 +592,34 @@ class LogicAgent:
 
     def win(self):
         self.score += REWARD_WIN
-        self.update_qtable(REWARD_WIN, self.previous_state, self.state)
+        self.update_qtable(REWARD_WIN, self.previous_state, self.state, done=True)
 
     def save(self, filename):
+        if filename.endswith(QTABLE_BINARY_EXTENSION):
+            from qtable import save_binary
+            save_binary(self.qtable, filename)
+            return
+        qtable = self.qtable
+        if self.qtable_backend != QTABLE_DICT:
+            qtable = qtable.to_dict()
         with open(filename, 'wb') as file:
-            pickle.dump(self.qtable, file)
+            pickle.dump(qtable, file)
 
 
 class Game:
-    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, play_mode=False):
+    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, play_mode=False, qtable_backend=QTABLE_DICT, metrics_file=None, seed=None, history_length=HISTORY_LENGTH, arena=None):
         self.play_mode = play_mode
+        self.history_length = history_length
+        self.arena = arena
+        self.qtable_backend = qtable_backend
         self.player_list = None
         self.max_wins = MAX_WIN
         self.ryu_wins = 0
         self.ken_wins = 0
         self.wins = 0
         self.iterations = 0
-        self.ken_score = []
-        self.ryu_score = []
+        self.fight_start = 0
+        self.metrics = TrainingMetrics(metrics_file)
         self.Ryu = None
         self.Ken = None
         self.env = None
@@ -341,37 +627,59 @@ class Game:
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.exit_game = False
+        self.checkpointer = None
+        self.convergence = None
+        self.compactor = None
+        self.rng = Random(seed)
+        self.turn_order = random_blocks(lambda: self.rng.choices(PLAYERS, k=RANDOM_BLOCK))
+
+    def seed_agents(self):
+        # each agent gets its own stream, derived from the game one so a single seed fixes the whole run
+        for player in PLAYERS:
+            self.env.agents[player].seed(self.rng.getrandbits(64))
 
     def setup(self):
-        self.env = LogicEnvironment(self.learning_rate, self.discount_factor)
+        self.env = LogicEnvironment(self.learning_rate, self.discount_factor, self.qtable_backend, self.history_length, self.arena)
+        self.seed_agents()
 
         self.Ken = self.env.agents[KEN]
         self.Ken.set_position()
-        self.Ken.load_qtable("KenQtable.qtable")
+        self.Ken.load_qtable(qtable_filename(KEN))
 
         self.Ryu = self.env.agents[RYU]
         self.Ryu.set_position()
 
-        self.Ryu.load_qtable("RyuQtable.qtable")
+        self.Ryu.load_qtable(qtable_filename(RYU))
 
     def check_end_game(self):
         if self.Ryu.is_dead() or self.Ken.is_dead():
             if self.Ryu.is_dead():
                 self.Ken.win()
                 self.ken_wins += 1
+                winner = KEN
                 # self.display_victory(KEN)
             else:
                 self.Ryu.win()
                 self.ryu_wins += 1
+                winner = RYU
                 # self.display_victory(RYU)
-            self.ken_score.append(self.Ken.get_score())
-            self.ryu_score.append(self.Ryu.get_score())
-            self.env.reset()
             self.wins += 1
+            self.metrics.record(self, winner, self.iterations - self.fight_start)
+            self.fight_start = self.iterations
+            self.env.reset()
             # print(self.ken_wins + self.ryu_wins)
+            if self.compactor is not None:
+                self.compactor.maybe_compact(self)
+            if self.convergence is not None and self.convergence.maybe_check(self):
+                # converged: stop the training loops and keep a checkpoint of the tables it stopped on
+                self.exit_game = True
+                if self.checkpointer is not None:
+                    self.checkpointer.save(self, wait=True)
+            elif self.checkpointer is not None:
+                self.checkpointer.maybe_save(self)
 
     def round(self):
-        player_start = choice(PLAYERS)
+        player_start = next(self.turn_order)
         if player_start == RYU:
             self.Ryu.do()
         else:
@@ -381,16 +689,15 @@ class Game:
 
     def end_game(self):
         self.env.reset()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
+        self.metrics.close()
         if not self.play_mode:
-            plt.figure(1)
-            plt.plot(self.ryu_score, label="Ryu")
-            plt.legend()
-            plt.savefig(f"graphs/RYU_{self.wins}_l_{self.learning_rate}_d_{self.discount_factor}.png")
-
-            plt.figure(2)
-            plt.plot(self.ken_score, label="Ken")
-            plt.legend()
-            plt.savefig(f"graphs/KEN_{self.wins}_l_{self.learning_rate}_d_{self.discount_factor}.png")
+            if self.metrics.filename is not None:
+                # plotting is only needed once, at the end: headless workers never import matplotlib before that
+                from report import plot_log
+                plot_log(self.metrics.filename, f"graphs/{{player}}_{self.wins}_l_{self.learning_rate}_d_{self.discount_factor}.png")
 
             self.Ryu.save("RyuQtable.qtable")
             self.Ken.save("KenQtable.qtable")
@@ -0,0 +1,90 @@
+import csv
+from collections import deque
+
+METRICS_WINDOW = 1000
+METRICS_BUFFER = 1 << 20
+FIELDS = ['episode', 'iterations', 'length', 'winner', 'ryu_score', 'ken_score',
+          'ryu_noise', 'ken_noise', 'ryu_qtable_size', 'ken_qtable_size']
+
+
+class RollingStats:
+    def __init__(self, window=METRICS_WINDOW):
+        self.values = deque(maxlen=window)
+        self.total = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if len(self.values) == self.values.maxlen:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / len(self.values) if self.values else 0
+
+
+class TrainingMetrics:
+    def __init__(self, filename=None, window=METRICS_WINDOW):
+        self.filename = filename
+        self.ryu_scores = RollingStats(window)
+        self.ken_scores = RollingStats(window)
+        self.lengths = RollingStats(window)
+        self.ryu_won = RollingStats(window)
+        self.last = None
+        self.file = None
+        self.writer = None
+        if filename is not None:
+            self.file = open(filename, 'a', newline='', buffering=METRICS_BUFFER)
+            self.writer = csv.writer(self.file)
+            if self.file.tell() == 0:
+                self.writer.writerow(FIELDS)
+
+    def record(self, game, winner, length):
+        self.last = {
+            'episode': game.wins,
+            'iterations': game.iterations,
+            'length': length,
+            'winner': winner,
+            'ryu_score': game.Ryu.get_score(),
+            'ken_score': game.Ken.get_score(),
+            'ryu_noise': game.Ryu.noise,
+            'ken_noise': game.Ken.noise,
+            'ryu_qtable_size': len(game.Ryu.qtable),
+            'ken_qtable_size': len(game.Ken.qtable),
+        }
+        self.ryu_scores.add(self.last['ryu_score'])
+        self.ken_scores.add(self.last['ken_score'])
+        self.lengths.add(length)
+        self.ryu_won.add(1 if winner == game.Ryu.player_name else 0)
+        if self.writer is not None:
+            self.writer.writerow([self.last[field] for field in FIELDS])
+
+    def ryu_win_rate(self):
+        return self.ryu_won.mean()
+
+    def ken_win_rate(self):
+        return 1 - self.ryu_won.mean() if self.ryu_won.values else 0
+
+    def summary(self):
+        return {
+            'ryu_score_avg': self.ryu_scores.mean(),
+            'ken_score_avg': self.ken_scores.mean(),
+            'ryu_score_min': self.ryu_scores.min,
+            'ryu_score_max': self.ryu_scores.max,
+            'ken_score_min': self.ken_scores.min,
+            'ken_score_max': self.ken_scores.max,
+            'ryu_win_rate': self.ryu_win_rate(),
+            'ken_win_rate': self.ken_win_rate(),
+            'length_avg': self.lengths.mean(),
+        }
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writer = None
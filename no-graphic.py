@@ -1,21 +1,27 @@
-import sys
+import argparse
+import os
 
+from checkpoint import CHECKPOINT_DIR, Checkpointer, latest_checkpoint, resume
+from compact import COMPACT_MIN_VALUE, Compactor
+from convergence import (CONVERGENCE_DELTA, CONVERGENCE_EVERY, CONVERGENCE_PATIENCE, CONVERGENCE_POLICY,
+                         CONVERGENCE_WIN_RATE, ConvergenceMonitor, parse_threshold)
 from logic import *
+from profiling import CPROFILE_FILE, STATS_EVERY, Profiler
 
 
 class Environment(LogicEnvironment):
-    def __init__(self, learning_rate, discount_factor):
-        super().__init__(learning_rate, discount_factor)
+    def __init__(self, learning_rate, discount_factor, qtable_backend=QTABLE_DICT, history_length=HISTORY_LENGTH, arena=None):
+        super().__init__(learning_rate, discount_factor, qtable_backend, history_length, arena)
         self.agents = {
-            RYU: Agent(self, RYU, learning_rate, discount_factor),
-            KEN: Agent(self, KEN, learning_rate, discount_factor),
+            RYU: Agent(self, RYU, learning_rate, discount_factor, qtable_backend, history_length),
+            KEN: Agent(self, KEN, learning_rate, discount_factor, qtable_backend, history_length),
         }
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
 
     def print_map(self):
-        for i in range(GRID_LIMIT):
-            if i == self.LEFT_WALL or i == self.RIGHT_WALL:
+        for i in range(self.arena.width):
+            if i == self.arena.left_wall or i == self.arena.right_wall:
                 print('|', end='')
             elif self.positions[RYU] == i and self.positions[KEN] == i:
                 print('O', end='')
@@ -29,20 +35,25 @@ class Environment(LogicEnvironment):
 
 
 class Agent(LogicAgent):
-    def __init__(self, environment, player_name, learning_rate, discount_factor):
-        super().__init__(environment, player_name, learning_rate, discount_factor)
+    def __init__(self, environment, player_name, learning_rate, discount_factor, qtable_backend=QTABLE_DICT, history_length=HISTORY_LENGTH):
+        super().__init__(environment, player_name, learning_rate, discount_factor, qtable_backend=qtable_backend, history_length=history_length)
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
 
 
 class NonGraphic(Game):
-    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR):
-        super().__init__(learning_rate, discount_factor)
+    def __init__(self, learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, qtable_backend=QTABLE_DICT, noise=0, metrics_file=None, seed=None, transition_table=False, history_length=HISTORY_LENGTH, arena=None):
+        super().__init__(learning_rate, discount_factor, qtable_backend=qtable_backend, metrics_file=metrics_file, seed=seed, history_length=history_length, arena=arena)
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
+        self.noise = noise
+        self.transition_table = transition_table
 
     def setup(self):
-        self.env = Environment(self.learning_rate, self.discount_factor)
+        self.env = Environment(self.learning_rate, self.discount_factor, self.qtable_backend, self.history_length, self.arena)
+        self.seed_agents()
+        if self.transition_table:
+            self.env.use_transition_table()
 
         self.Ken = self.env.agents[KEN]
         # self.Ken.load_qtable("KenQtable.qtable")
@@ -50,20 +61,106 @@ class NonGraphic(Game):
         self.Ryu = self.env.agents[RYU]
         # self.Ryu.load_qtable("RyuQtable.qtable")
 
-    def run(self):
+        self.Ken.noise = self.noise
+        self.Ryu.noise = self.noise
+
+    def train(self):
         while self.wins < self.max_wins and not self.exit_game:
             self.round()
             self.check_end_game()
             if self.Ken.get_score() < -35000 or self.Ryu.get_score() < -35000:
-                self.end_game()
-                exit(0)
-            if self.wins >= self.max_wins:
-                self.end_game()
-                exit(0)
+                return
+
+    def run(self):
+        self.train()
+        for report in self.compactor.reports if self.compactor is not None else []:
+            print(f"Compaction at {report['wins']} fights: "
+                  + ', '.join(f'{player} {report[player][0]} -> {report[player][1]} rows' for player in PLAYERS if player in report))
+        if self.convergence is not None and self.convergence.converged:
+            report = self.convergence.report()
+            print(f"Converged after {report['converged_at']} fights: max |dQ| {report['max_delta']:.4f}, "
+                  f"policy change {report['policy_change']:.2%}, win rate spread {report['win_rate_spread']:.2%}")
+        self.end_game()
+        exit(0)
 
 
 if __name__ == '__main__':
-    window = NonGraphic(learning_rate=float(sys.argv[1]) / 100.0,
-                     discount_factor=float(sys.argv[2]) / 100.0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('learning_rate', type=float, help='learning rate in percent')
+    parser.add_argument('discount_factor', type=float, help='discount factor in percent')
+    parser.add_argument('--noise', type=float, default=0, help='initial exploration rate')
+    parser.add_argument('--seed', type=int, help='seed of the turn order and exploration draws')
+    parser.add_argument('--qtable', choices=QTABLE_BACKENDS, default=QTABLE_DICT, help='qtable storage backend')
+    parser.add_argument('--history', type=int, default=HISTORY_LENGTH, help='opponent actions shown on the radar')
+    parser.add_argument('--width', type=int, default=GRID_LIMIT, help='arena cells, walls included')
+    parser.add_argument('--radius', type=int, default=RADAR_RADIUS, help='radar slots on each side of the fighter')
+    parser.add_argument('--bucketing', choices=BUCKETINGS, default=BUCKETING_LINEAR, help='distance of each radar slot')
+    parser.add_argument('--transition-table', action='store_true', help='resolve actions with the precomputed transitions')
+    parser.add_argument('--replay', type=int, help='learn from an experience replay buffer of this capacity (dense qtable)')
+    parser.add_argument('--replay-batch', type=int, default=REPLAY_BATCH, help='transitions per replayed minibatch')
+    parser.add_argument('--replay-every', type=int, default=REPLAY_EVERY, help='steps between two minibatches')
+    parser.add_argument('--prioritized', action='store_true', help='sample transitions by their last TD error')
+    parser.add_argument('--converge', action='store_true', help='stop once the qtables and the win rate stop changing')
+    parser.add_argument('--converge-every', type=int, default=CONVERGENCE_EVERY, help='fights between two convergence checks')
+    parser.add_argument('--max-delta', type=parse_threshold, default=CONVERGENCE_DELTA, help='largest |dQ| between two checks, ignored by default')
+    parser.add_argument('--policy-change', type=parse_threshold, default=CONVERGENCE_POLICY, help="fraction of states changing their best action, 'off' to ignore")
+    parser.add_argument('--win-rate-band', type=parse_threshold, default=CONVERGENCE_WIN_RATE, help="spread of the Ryu win rate over the patience window, 'off' to ignore")
+    parser.add_argument('--patience', type=int, default=CONVERGENCE_PATIENCE, help='checks in a row that must meet the thresholds')
+    parser.add_argument('--compact-every', type=int, help='drop the qtable rows that carry no information every N wins')
+    parser.add_argument('--compact-min-value', type=float, default=COMPACT_MIN_VALUE, help='drop rows whose values all stay within this distance of 0')
+    parser.add_argument('--min-visits', type=int, help='also drop rows updated fewer times than this')
+    parser.add_argument('--max-age', type=int, help='also drop rows not updated for this many compactions')
+    parser.add_argument('--symmetric', action='store_true', help='keep a single qtable row per mirrored pair of states')
+    parser.add_argument('--ryu-qtable', help='start Ryu from this qtable, e.g. one solved by solver.py')
+    parser.add_argument('--ken-qtable', help='start Ken from this qtable')
+    parser.add_argument('--checkpoint-every', type=int, help='checkpoint every N wins')
+    parser.add_argument('--checkpoint-seconds', type=float, help='checkpoint every T seconds')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR)
+    parser.add_argument('--resume', action='store_true', help='restart from the latest checkpoint')
+    parser.add_argument('--metrics', help='per fight csv log, plotted at the end of the training')
+    parser.add_argument('--stats', action='store_true', help='report throughput and time per phase periodically')
+    parser.add_argument('--stats-every', type=float, default=STATS_EVERY, help='seconds between two reports')
+    parser.add_argument('--stats-file', help='append reports as json lines to this file instead of stderr')
+    parser.add_argument('--cprofile', type=int, default=0, help='dump a cProfile of this many steps')
+    parser.add_argument('--cprofile-start', type=int, default=0, help='step at which the cProfile window starts')
+    parser.add_argument('--cprofile-file', default=CPROFILE_FILE)
+    args = parser.parse_args()
+    learning_rate = args.learning_rate / 100.0
+    discount_factor = args.discount_factor / 100.0
+    metrics_file = args.metrics or f'graphs/metrics_l_{learning_rate}_d_{discount_factor}.csv'
+    os.makedirs(os.path.dirname(metrics_file) or '.', exist_ok=True)
+    window = NonGraphic(learning_rate=learning_rate,
+                        discount_factor=discount_factor,
+                        qtable_backend=args.qtable,
+                        noise=args.noise,
+                        metrics_file=metrics_file,
+                        seed=args.seed,
+                        transition_table=args.transition_table,
+                        history_length=args.history,
+                        arena=Arena(args.width, args.radius, args.bucketing))
+    if args.checkpoint_every or args.checkpoint_seconds or args.converge:
+        # with --converge alone, the only checkpoint is the one taken when the run converges
+        window.checkpointer = Checkpointer(args.checkpoint_dir, args.checkpoint_every, args.checkpoint_seconds)
+    if args.converge:
+        window.convergence = ConvergenceMonitor(args.converge_every, args.max_delta, args.policy_change, args.win_rate_band, args.patience)
     window.setup()
+    for player, filename in [(RYU, args.ryu_qtable), (KEN, args.ken_qtable)]:
+        if filename:
+            window.env.agents[player].load_qtable(filename)
+    if args.compact_every:
+        window.compactor = Compactor(args.compact_every, args.compact_min_value, args.min_visits, args.max_age, args.symmetric)
+        window.compactor.attach(window)
+    elif args.symmetric:
+        for agent in window.env.agents.values():
+            agent.use_symmetry()
+    if args.replay:
+        for agent in window.env.agents.values():
+            agent.use_replay(args.replay, args.replay_batch, args.replay_every, args.prioritized)
+    if args.resume:
+        checkpoint = latest_checkpoint(args.checkpoint_dir)
+        if checkpoint is not None:
+            resume(window, checkpoint)
+            print(f'Resumed from {checkpoint} ({window.wins} wins)')
+    if args.stats or args.stats_file or args.cprofile:
+        Profiler(args.stats_every, args.stats_file, args.cprofile, args.cprofile_start, args.cprofile_file).instrument(window)
     window.run()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import time
+from importlib import import_module
+from multiprocessing import Lock, Process
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from logic import ACTIONS, DISCOUNT_FACTOR, KEN, LEARNING_RATE, MAX_WIN, PLAYERS, QTABLE_DENSE, RYU
+from qtable import NUM_STATES, DenseQTable, save_table
+
+WINS, RYU_WINS, KEN_WINS, ITERATIONS = range(4)
+COUNTERS = 4
+
+
+class SharedTraining:
+    # the qtables (one per player, or one per fighter of a league.py population), the global counters and
+    # the noise of each table, in shared memory blocks that every worker maps: qtable updates are lock free
+    # (hogwild), counters and noise go through the lock
+    def __init__(self, blocks, owner=False, tables=len(PLAYERS)):
+        self.blocks = blocks
+        self.owner = owner
+        self.values = np.ndarray((tables, NUM_STATES, len(ACTIONS)), np.float32, blocks['values'].buf)
+        self.visited = np.ndarray((tables, NUM_STATES), bool, blocks['visited'].buf)
+        self.counters = np.ndarray(COUNTERS, np.int64, blocks['counters'].buf)
+        self.noise = np.ndarray(tables, np.float64, blocks['noise'].buf)
+
+    @classmethod
+    def create(cls, noise=0, tables=len(PLAYERS)):
+        sizes = {
+            'values': tables * NUM_STATES * len(ACTIONS) * np.dtype(np.float32).itemsize,
+            'visited': tables * NUM_STATES,
+            'counters': COUNTERS * np.dtype(np.int64).itemsize,
+            'noise': tables * np.dtype(np.float64).itemsize,
+        }
+        shared = cls({name: SharedMemory(create=True, size=size) for name, size in sizes.items()}, owner=True, tables=tables)
+        shared.values[:] = 0
+        shared.visited[:] = False
+        shared.counters[:] = 0
+        shared.noise[:] = noise
+        return shared
+
+    @classmethod
+    def attach(cls, names, tables=len(PLAYERS)):
+        return cls({name: SharedMemory(name=block) for name, block in names.items()}, tables=tables)
+
+    def names(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def qtable(self, player):
+        return self.table(PLAYERS.index(player))
+
+    def table(self, index):
+        return DenseQTable(values=self.values[index], visited=self.visited[index])
+
+    def close(self):
+        # the arrays point into the blocks, they have to go before the mappings are closed
+        self.values = self.visited = self.counters = self.noise = None
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+
+
+def sync(game, shared, lock, last):
+    # push this worker's fights and iterations since the last sync, apply its noise decay to the shared
+    # schedule and continue from the shared value, so noise decays with the explorations of all workers
+    with lock:
+        shared.counters[WINS] += game.wins - last['wins']
+        shared.counters[RYU_WINS] += game.ryu_wins - last['ryu_wins']
+        shared.counters[KEN_WINS] += game.ken_wins - last['ken_wins']
+        shared.counters[ITERATIONS] += game.iterations - last['iterations']
+        for i, player in enumerate(PLAYERS):
+            agent = game.env.agents[player]
+            if last['noise'][i] > 0:
+                shared.noise[i] *= agent.noise / last['noise'][i]
+            agent.noise = float(shared.noise[i])
+        done = shared.counters[WINS] >= game.max_wins
+    last.update(wins=game.wins, ryu_wins=game.ryu_wins, ken_wins=game.ken_wins, iterations=game.iterations,
+                noise=[game.env.agents[player].noise for player in PLAYERS])
+    return done
+
+
+def worker(learning_rate, discount_factor, max_wins, names, lock, seed):
+    shared = SharedTraining.attach(names)
+    game = import_module('no-graphic').NonGraphic(learning_rate, discount_factor, QTABLE_DENSE, seed=seed)
+    game.setup()
+    game.max_wins = max_wins
+    for player in PLAYERS:
+        game.env.agents[player].qtable = shared.qtable(player)
+    last = {'wins': 0, 'ryu_wins': 0, 'ken_wins': 0, 'iterations': 0, 'noise': [0, 0]}
+    done = sync(game, shared, lock, last)
+    while not done:
+        wins = game.wins
+        game.round()
+        game.check_end_game()
+        if game.wins != wins:
+            done = sync(game, shared, lock, last)
+    sync(game, shared, lock, last)
+    game.metrics.close()
+    for player in PLAYERS:
+        game.env.agents[player].qtable = None
+    shared.close()
+
+
+def train(learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, max_wins=MAX_WIN, workers=None, noise=0, seed=None):
+    workers = workers or os.cpu_count()
+    shared = SharedTraining.create(noise)
+    lock = Lock()
+    try:
+        start = time.perf_counter()
+        processes = [Process(target=worker, args=(learning_rate, discount_factor, max_wins, shared.names(), lock,
+                                                  None if seed is None else seed + i))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        qtables = {player: DenseQTable(values=shared.values[i].copy(), visited=shared.visited[i].copy())
+                   for i, player in enumerate(PLAYERS)}
+        counters = shared.counters.copy()
+    finally:
+        shared.close()
+    return qtables, counters, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train one Ryu and one Ken qtable with several processes')
+    parser.add_argument('learning_rate', type=float, help='learning rate in percent')
+    parser.add_argument('discount_factor', type=float, help='discount factor in percent')
+    parser.add_argument('--workers', type=int, help='training processes, defaults to the cpu count')
+    parser.add_argument('--wins', type=int, default=MAX_WIN, help='fights played by all workers together')
+    parser.add_argument('--noise', type=float, default=0, help='initial exploration rate')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    qtables, counters, elapsed = train(args.learning_rate / 100.0, args.discount_factor / 100.0, args.wins,
+                                       args.workers, args.noise, args.seed)
+    print(f'{counters[WINS]} fights, {counters[ITERATIONS]} steps in {elapsed:.2f}s '
+          f'({counters[WINS] / elapsed:.1f} fights/s, {counters[ITERATIONS] / elapsed:.0f} steps/s), '
+          f'Ryu wins {counters[RYU_WINS]}, Ken wins {counters[KEN_WINS]}')
+    for player in [RYU, KEN]:
+        save_table(qtables[player], f'{player}Qtable.qtable')
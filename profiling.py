@@ -0,0 +1,114 @@
+import cProfile
+import json
+import sys
+from collections import defaultdict
+from time import perf_counter
+
+from logic import PLAYERS
+
+STATS_EVERY = 5.0
+CHECK_EVERY_STEPS = 1024
+CPROFILE_FILE = "hadoken.pstats"
+
+
+class Profiler:
+    # timers are only installed by instrument(): a game that is not instrumented runs the original methods untouched
+    def __init__(self, every=STATS_EVERY, stats_file=None, cprofile_steps=0, cprofile_start=0, cprofile_file=CPROFILE_FILE):
+        self.every = every
+        self.stats_file = stats_file
+        self.cprofile_steps = cprofile_steps
+        self.cprofile_start = cprofile_start
+        self.cprofile_file = cprofile_file
+        self.cprofile = None
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.steps = 0
+        self.game = None
+        self.last = None
+
+    def timed(self, phase, method):
+        times, calls, clock = self.times, self.calls, perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[phase] += clock() - start
+                calls[phase] += 1
+        return wrapper
+
+    def instrument(self, game):
+        self.game = game
+        env = game.env
+        env.do = self.timed('env_do', env.do)
+        env.get_radar = self.timed('get_radar', env.get_radar)
+        for player in PLAYERS:
+            agent = env.agents[player]
+            agent.choose_action = self.timed('choose_action', agent.choose_action)
+            agent.update_qtable = self.timed('update_qtable', agent.update_qtable)
+        timed_round = self.timed('round', game.round)
+
+        def round():
+            player = timed_round()
+            self.steps += 1
+            if self.cprofile_steps:
+                self.sample_cprofile()
+            if self.steps % CHECK_EVERY_STEPS == 0 and perf_counter() - self.last['time'] >= self.every:
+                self.report()
+            return player
+        game.round = round
+        self.last = self.snapshot()
+
+    def snapshot(self):
+        game = self.game
+        return {
+            'time': perf_counter(),
+            'iterations': game.iterations,
+            'wins': game.wins,
+            'qtable_sizes': [len(game.env.agents[player].qtable) for player in PLAYERS],
+            'times': dict(self.times),
+        }
+
+    def sample_cprofile(self):
+        if self.cprofile is None and self.steps >= self.cprofile_start:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif self.steps >= self.cprofile_start + self.cprofile_steps:
+            self.stop_cprofile()
+
+    def stop_cprofile(self):
+        if self.cprofile is None:
+            return
+        self.cprofile.disable()
+        self.cprofile.dump_stats(self.cprofile_file)
+        print(f'cProfile of {self.cprofile_steps} steps written to {self.cprofile_file}', file=sys.stderr)
+        self.cprofile = None
+        self.cprofile_steps = 0
+
+    def report(self):
+        now = self.snapshot()
+        last, self.last = self.last, now
+        elapsed = now['time'] - last['time']
+        stats = {
+            'iterations': now['iterations'],
+            'wins': now['wins'],
+            'steps_per_sec': (now['iterations'] - last['iterations']) / elapsed,
+            'episodes_per_sec': (now['wins'] - last['wins']) / elapsed,
+            'qtable_growth_per_sec': {player: (size - old) / elapsed for player, size, old
+                                      in zip(PLAYERS, now['qtable_sizes'], last['qtable_sizes'])},
+            'noise': {player: self.game.env.agents[player].noise for player in PLAYERS},
+            # phases are nested (round > env_do > get_radar), shares are of wall time and inclusive
+            'time_share': {phase: (total - last['times'].get(phase, 0)) / elapsed for phase, total in now['times'].items()},
+            'calls': dict(self.calls),
+        }
+        if self.stats_file is not None:
+            with open(self.stats_file, 'a') as file:
+                file.write(json.dumps(stats) + '\n')
+        else:
+            shares = ' '.join(f'{phase} {share:.0%}' for phase, share in stats['time_share'].items())
+            growth = ' '.join(f'{player} +{rate:.0f}/s' for player, rate in stats['qtable_growth_per_sec'].items())
+            noise = ' '.join(f'{player} {value:.3g}' for player, value in stats['noise'].items())
+            print(f"[{stats['wins']} wins] {stats['steps_per_sec']:.0f} steps/s, {stats['episodes_per_sec']:.1f} fights/s, "
+                  f"qtable {growth}, noise {noise}, time {shares}", file=sys.stderr)
+        return stats
@@ -0,0 +1,284 @@
+import json
+import pickle
+import struct
+import sys
+from ast import literal_eval
+
+import numpy as np
+
+from logic import (ACTIONS, GRID_LIMIT, HISTORY_LENGTH, ORIENTATION_LEFT, ORIENTATION_RIGHT, QTABLE_BINARY_EXTENSION,
+                   STANCES, radar_slots)
+
+BLANK_STATE = ('_',) * (9 + HISTORY_LENGTH)
+
+BINARY_MAGIC = b'HQTB'
+BINARY_VERSION = 1
+KEY_FIELD_WIDTH = 2
+
+ACTION_CODES = {action: i for i, action in enumerate(ACTIONS)}
+CODED_ORIENTATIONS = [ORIENTATION_LEFT, ORIENTATION_RIGHT]
+ORIENTATION_CODES = {orientation: i for i, orientation in enumerate(CODED_ORIENTATIONS)}
+STANCE_CODES = {stance: i for i, stance in enumerate(STANCES)}
+
+
+def build_radar_layouts():
+    layouts = {}
+    layout_ids = np.zeros((GRID_LIMIT, GRID_LIMIT, len(STANCES)), dtype=np.int64)
+    for player_position in range(GRID_LIMIT):
+        for opponent_position in range(GRID_LIMIT):
+            for opponent_stance in STANCES:
+                layout = tuple(radar_slots(player_position, opponent_position, opponent_stance))
+                layout_ids[player_position, opponent_position, STANCE_CODES[opponent_stance]] = layouts.setdefault(layout, len(layouts))
+    return layouts, layout_ids
+
+
+RADAR_LAYOUTS, RADAR_LAYOUT_IDS = build_radar_layouts()
+LAYOUTS_LIST = list(RADAR_LAYOUTS)
+HISTORY_STATES = len(ACTIONS) ** HISTORY_LENGTH
+# one extra id at the end for the blank radar agents start with before the first reset
+NUM_STATES = len(RADAR_LAYOUTS) * len(ORIENTATION_CODES) * len(STANCES) * HISTORY_STATES + 1
+BLANK_STATE_ID = NUM_STATES - 1
+
+
+# radars come back constantly during a training, their ids are computed once
+STATE_IDS = {}
+
+
+def encode_state(radar):
+    state_id = STATE_IDS.get(radar)
+    if state_id is None:
+        state_id = STATE_IDS[radar] = compute_state_id(radar)
+    return state_id
+
+
+def compute_state_id(radar):
+    if radar == BLANK_STATE:
+        return BLANK_STATE_ID
+    code = RADAR_LAYOUTS[radar[:7]]
+    code = code * len(ORIENTATION_CODES) + ORIENTATION_CODES[radar[7]]
+    code = code * len(STANCES) + STANCE_CODES[radar[8]]
+    for action in radar[9:]:
+        code = code * len(ACTIONS) + ACTION_CODES[action]
+    return code
+
+
+def encode_states(player_positions, opponent_positions, opponent_stances, orientations, stances, histories):
+    # histories: (n, HISTORY_LENGTH) opponent action codes, most recent first
+    code = RADAR_LAYOUT_IDS[player_positions, opponent_positions, opponent_stances]
+    code = code * len(ORIENTATION_CODES) + orientations
+    code = code * len(STANCES) + stances
+    for i in range(HISTORY_LENGTH):
+        code = code * len(ACTIONS) + histories[:, i]
+    return code
+
+
+def decode_state(code):
+    if code == BLANK_STATE_ID:
+        return BLANK_STATE
+    history = []
+    for _ in range(HISTORY_LENGTH):
+        code, action = divmod(code, len(ACTIONS))
+        history.insert(0, ACTIONS[action])
+    code, stance = divmod(code, len(STANCES))
+    layout, orientation = divmod(code, len(ORIENTATION_CODES))
+    return LAYOUTS_LIST[layout] + (CODED_ORIENTATIONS[orientation], STANCES[stance]) + tuple(history)
+
+
+class DenseQTable:
+    def __init__(self, dtype=np.float32, values=None, visited=None):
+        self.values = np.zeros((NUM_STATES, len(ACTIONS)), dtype=dtype) if values is None else values
+        self.visited = np.zeros(NUM_STATES, dtype=bool) if visited is None else visited
+
+    def __len__(self):
+        return int(np.count_nonzero(self.visited))
+
+    def __contains__(self, state):
+        return bool(self.visited[encode_state(state)])
+
+    def __getitem__(self, state):
+        return dict(zip(ACTIONS, self.values[encode_state(state)].tolist()))
+
+    def add_state(self, state):
+        state_id = encode_state(state)
+        self.visited[state_id] = True
+        return state_id
+
+    def best_action(self, state):
+        return ACTIONS[int(self.values[self.add_state(state)].argmax())]
+
+    def update(self, prev_state, action, reward, new_state, learning_rate, discount_factor):
+        prev_id = self.add_state(prev_state)
+        new_id = self.add_state(new_state)
+        action_id = ACTION_CODES[action]
+        max_q = float(self.values[new_id].max())
+        q = float(self.values[prev_id, action_id])
+        self.values[prev_id, action_id] = q + learning_rate * (reward + discount_factor * max_q - q)
+
+    def items(self):
+        for state_id in np.flatnonzero(self.visited):
+            yield decode_state(state_id), dict(zip(ACTIONS, self.values[state_id].tolist()))
+
+    def to_dict(self):
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, table, dtype=np.float32):
+        dense = cls(dtype)
+        for state, actions in table.items():
+            state_id = dense.add_state(state)
+            for action, value in actions.items():
+                if action in ACTION_CODES:
+                    dense.values[state_id, ACTION_CODES[action]] = value
+        return dense
+
+    def nbytes(self):
+        return self.values.nbytes + self.visited.nbytes
+
+
+# radar values are few, their fixed-width encodings are cached both ways
+FIELD_BYTES = {}
+FIELD_VALUES = {}
+
+
+def encode_field(value):
+    if value not in FIELD_BYTES:
+        field = f'{value:+d}' if isinstance(value, int) else value
+        if len(field) > KEY_FIELD_WIDTH:
+            raise ValueError(f'Radar value too long for the binary format: {value!r}')
+        FIELD_BYTES[value] = field.ljust(KEY_FIELD_WIDTH).encode('ascii')
+    return FIELD_BYTES[value]
+
+
+def decode_field(field):
+    if field not in FIELD_VALUES:
+        text = field.decode('ascii').rstrip()
+        FIELD_VALUES[field] = int(text) if text[:1] in ('+', '-') and len(text) > 1 else text
+    return FIELD_VALUES[field]
+
+
+def encode_key(state):
+    try:
+        return b''.join([FIELD_BYTES[value] for value in state])
+    except KeyError:
+        return b''.join([encode_field(value) for value in state])
+
+
+def decode_key(key):
+    fields = [key[i:i + KEY_FIELD_WIDTH] for i in range(0, len(key), KEY_FIELD_WIDTH)]
+    try:
+        return tuple([FIELD_VALUES[field] for field in fields])
+    except KeyError:
+        return tuple([decode_field(field) for field in fields])
+
+
+def save_binary(table, filename, dtype=np.float64):
+    # layout: magic, header length, json header, sorted fixed-width state keys, then the values matrix
+    rows = list(table.items())
+    actions = list(dict.fromkeys(action for _, row in rows for action in row))
+    key_width = max((len(state) for state, _ in rows), default=0) * KEY_FIELD_WIDTH
+    keys = np.array([encode_key(state) for state, _ in rows], dtype=f'S{max(key_width, 1)}')
+    values = np.array([[row.get(action, np.nan) for action in actions] for _, row in rows], dtype=dtype)
+    values = values.reshape(len(rows), len(actions))
+    order = np.argsort(keys, kind='stable')
+
+    header = {'actions': actions, 'states': len(rows), 'key_width': keys.dtype.itemsize, 'dtype': values.dtype.str}
+    header_bytes = json.dumps(header).encode()
+    keys_offset = len(BINARY_MAGIC) + 8 + len(header_bytes)
+    values_offset = keys_offset + keys.nbytes
+    padding = -values_offset % values.dtype.itemsize
+    with open(filename, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        file.write(struct.pack('<II', BINARY_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        file.write(keys[order].tobytes())
+        file.write(b'\0' * padding)
+        file.write(values[order].tobytes())
+
+
+class MappedQTable:
+    # read-only qtable backed by a memory map, processes opening the same file share its pages
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            magic = file.read(len(BINARY_MAGIC))
+            if magic != BINARY_MAGIC:
+                raise ValueError(f'{filename} is not a binary qtable')
+            version, header_length = struct.unpack('<II', file.read(8))
+            if version != BINARY_VERSION:
+                raise ValueError(f'Unsupported binary qtable version {version}')
+            header = json.loads(file.read(header_length))
+        self.actions = header['actions']
+        self.action_codes = {action: i for i, action in enumerate(self.actions)}
+        states = header['states']
+        dtype = np.dtype(header['dtype'])
+        keys_offset = len(BINARY_MAGIC) + 8 + header_length
+        values_offset = keys_offset + states * header['key_width']
+        values_offset += -values_offset % dtype.itemsize
+        if states == 0:
+            self.keys = np.empty(0, dtype=f"S{header['key_width']}")
+            self.values = np.empty((0, len(self.actions)), dtype=dtype)
+            return
+        self.keys = np.memmap(filename, dtype=f"S{header['key_width']}", mode='r', offset=keys_offset, shape=(states,))
+        self.values = np.memmap(filename, dtype=dtype, mode='r', offset=values_offset, shape=(states, len(self.actions)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row_index(self, state):
+        key = encode_key(state)
+        index = int(np.searchsorted(self.keys, key))
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def __contains__(self, state):
+        return self.row_index(state) is not None
+
+    def __getitem__(self, state):
+        index = self.row_index(state)
+        if index is None:
+            raise KeyError(state)
+        return self.row(index)
+
+    def row(self, index):
+        return {a: v for a, v in zip(self.actions, self.values[index].tolist()) if v == v}
+
+    def best_action(self, state):
+        index = self.row_index(state)
+        if index is None:
+            return ACTIONS[0]
+        return self.actions[int(np.nanargmax(self.values[index]))]
+
+    def items(self):
+        for key, row in zip(self.keys.tolist(), self.values.tolist()):
+            yield decode_key(key), {a: v for a, v in zip(self.actions, row) if v == v}
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def load_table(filename):
+    if filename.endswith(QTABLE_BINARY_EXTENSION):
+        return MappedQTable(filename).to_dict()
+    if filename.endswith('.json'):
+        with open(filename) as file:
+            return literal_eval(file.read())
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+def save_table(table, filename):
+    if filename.endswith(QTABLE_BINARY_EXTENSION):
+        save_binary(table, filename)
+    elif filename.endswith('.json'):
+        with open(filename, 'w') as file:
+            file.write(repr(dict(table.items())))
+    else:
+        with open(filename, 'wb') as file:
+            pickle.dump(dict(table.items()), file)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(f'usage: python3 qtable.py <source> <destination>  (.qtable pickle, .json repr or {QTABLE_BINARY_EXTENSION} binary)')
+        sys.exit(1)
+    save_table(load_table(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,73 @@
+import numpy as np
+
+from logic import REPLAY_BATCH, REPLAY_CAPACITY, REPLAY_EVERY
+
+PRIORITY_ALPHA = 0.6
+PRIORITY_BETA = 0.4
+PRIORITY_EPSILON = 1e-3
+
+
+class ReplayBuffer:
+    # circular buffer of (state_id, action, reward, next_state_id, done), one per fighter;
+    # every `every` transitions a minibatch is replayed into the dense qtable values in one vectorized update
+    def __init__(self, capacity=REPLAY_CAPACITY, batch_size=REPLAY_BATCH, every=REPLAY_EVERY, prioritized=False, seed=None):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.every = every
+        self.prioritized = prioritized
+        self.rng = np.random.default_rng(seed)
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros(capacity, dtype=np.int64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.priorities = np.zeros(capacity, dtype=np.float64) if prioritized else None
+        self.max_priority = 1.0
+        self.position = 0
+        self.size = 0
+        self.added = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done=False):
+        # returns True when a minibatch is due
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        if self.prioritized:
+            # new transitions get the highest priority so each is replayed at least once soon
+            self.priorities[i] = self.max_priority
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+        return self.added % self.every == 0 and self.size >= self.batch_size
+
+    def sample(self):
+        if not self.prioritized:
+            return self.rng.integers(self.size, size=self.batch_size), None
+        scaled = self.priorities[:self.size] ** PRIORITY_ALPHA
+        probabilities = scaled / scaled.sum()
+        indexes = self.rng.choice(self.size, size=self.batch_size, p=probabilities)
+        # importance sampling weights correct the bias of prioritized draws, normalized to at most 1
+        weights = (self.size * probabilities[indexes]) ** -PRIORITY_BETA
+        return indexes, weights / weights.max()
+
+    def train(self, values, learning_rate, discount_factor):
+        indexes, weights = self.sample()
+        states, actions, next_states = self.states[indexes], self.actions[indexes], self.next_states[indexes]
+        max_q = values[next_states].max(axis=1).astype(np.float64)
+        max_q[self.dones[indexes]] = 0.0
+        q = values[states, actions].astype(np.float64)
+        td_errors = self.rewards[indexes] + discount_factor * max_q - q
+        steps = learning_rate * td_errors if weights is None else learning_rate * weights * td_errors
+        # a transition drawn twice in the same minibatch is applied once (last write wins),
+        # adding the steps up overshoots with learning rates close to 1
+        values[states, actions] = q + steps
+        if self.prioritized:
+            self.priorities[indexes] = np.abs(td_errors) + PRIORITY_EPSILON
+            self.max_priority = max(self.max_priority, float(self.priorities[indexes].max()))
+        return td_errors
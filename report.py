@@ -0,0 +1,42 @@
+import csv
+import sys
+
+from matplotlib import pyplot as plt
+
+MAX_PLOT_POINTS = 2000
+
+
+def read_log(filename, columns):
+    with open(filename, newline='') as file:
+        reader = csv.DictReader(file)
+        rows = [[float(row[column]) for column in columns] for row in reader]
+    return [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+
+
+def downsample(values, max_points=MAX_PLOT_POINTS):
+    # averages consecutive buckets so that plots stay fast whatever the number of episodes
+    if len(values) <= max_points:
+        return list(range(len(values))), values
+    size = -(-len(values) // max_points)
+    xs, ys = [], []
+    for start in range(0, len(values), size):
+        bucket = values[start:start + size]
+        xs.append(start + len(bucket) // 2)
+        ys.append(sum(bucket) / len(bucket))
+    return xs, ys
+
+
+def plot_log(filename, output, max_points=MAX_PLOT_POINTS):
+    ryu_scores, ken_scores = read_log(filename, ['ryu_score', 'ken_score'])
+    for figure, (player, scores) in enumerate([("Ryu", ryu_scores), ("Ken", ken_scores)], start=1):
+        plt.figure(figure)
+        plt.plot(*downsample(scores, max_points), label=player)
+        plt.legend()
+        plt.savefig(output.format(player=player.upper()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python3 report.py <metrics.csv> [output, default graphs/{player}.png]')
+        sys.exit(1)
+    plot_log(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'graphs/{player}.png')
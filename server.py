@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import random
+import time
+
+from logic import ACTIONS, KEN, RYU, arg_max, qtable_filename
+from qtable import load_table
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 7878
+WATCH_SECONDS = 1.0
+STREAM_LIMIT = 1 << 24
+LOAD_TEST_CONNECTIONS = 4
+LOAD_TEST_REQUESTS = 5000
+LOAD_TEST_BATCH = 16
+
+
+class Policy:
+    # greedy action of every state of a table, computed once at load; unknown states play ACTIONS[0]
+    # like an all-zero row. Symmetric tables (compact.py --symmetric) are read through the mirrored states
+    def __init__(self, filename, symmetric=False):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        self.actions = {state: arg_max(actions) for state, actions in load_table(filename).items()}
+        self.canonical_states = None
+        if symmetric:
+            from compact import MIRRORED_ACTIONS, CanonicalStates
+            self.canonical_states = CanonicalStates()
+            self.mirrored_actions = MIRRORED_ACTIONS
+
+    def __len__(self):
+        return len(self.actions)
+
+    def action(self, state):
+        if self.canonical_states is None:
+            return self.actions.get(state, ACTIONS[0])
+        state, mirrored = self.canonical_states[state]
+        action = self.actions.get(state, ACTIONS[0])
+        return self.mirrored_actions[action] if mirrored else action
+
+
+class PolicyServer:
+    # one json object per line each way:
+    #   {"id": 1, "player": "Ryu", "states": [radar, ...]} -> {"id": 1, "actions": [action, ...]}
+    #   {"id": 2, "reload": "Ryu", "file": "new.qtable"}   -> {"id": 2, "reloaded": "Ryu", "states": n}
+    # a reload builds the new policy off the event loop and swaps it in, connections stay open and
+    # queries already running finish on the previous table
+    def __init__(self, files, symmetric=False, watch=WATCH_SECONDS):
+        self.files = files
+        self.symmetric = symmetric
+        self.watch = watch
+        self.policies = {player: Policy(filename, symmetric) for player, filename in files.items()}
+
+    async def reload(self, player, filename=None):
+        filename = filename or self.files[player]
+        loop = asyncio.get_running_loop()
+        policy = await loop.run_in_executor(None, Policy, filename, self.symmetric)
+        self.files[player] = filename
+        self.policies[player] = policy
+        print(f'{player}: loaded {filename} ({len(policy)} states)')
+        return policy
+
+    async def watch_files(self):
+        # hot reload of a table file rewritten in place, e.g. by a training saving its tables
+        while True:
+            await asyncio.sleep(self.watch)
+            for player, policy in list(self.policies.items()):
+                try:
+                    changed = os.path.getmtime(policy.filename) != policy.mtime
+                except OSError:
+                    continue
+                if changed:
+                    try:
+                        await self.reload(player, policy.filename)
+                    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as error:
+                        # the file may still be being written, the next poll tries again
+                        print(f'{player}: reload of {policy.filename} failed: {error}')
+
+    async def answer(self, request):
+        if 'reload' in request:
+            policy = await self.reload(request['reload'], request.get('file'))
+            return {'id': request.get('id'), 'reloaded': request['reload'], 'states': len(policy)}
+        policy = self.policies[request['player']]
+        return {'id': request.get('id'), 'actions': [policy.action(tuple(state)) for state in request['states']]}
+
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.answer(json.loads(line))
+                except (KeyError, TypeError, ValueError, OSError, EOFError, pickle.UnpicklingError) as error:
+                    response = {'error': f'{type(error).__name__}: {error}'}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, unix, limit=STREAM_LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=STREAM_LIMIT)
+        watcher = asyncio.create_task(self.watch_files()) if self.watch else None
+        print(f"Serving {', '.join(f'{player} ({len(policy)} states)' for player, policy in self.policies.items())} "
+              f"on {unix or f'{host}:{port}'}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+async def connect(host=SERVER_HOST, port=SERVER_PORT, unix=None):
+    if unix:
+        return await asyncio.open_unix_connection(unix, limit=STREAM_LIMIT)
+    return await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+
+
+async def query(reader, writer, request):
+    writer.write(json.dumps(request).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load_test(states, player=RYU, connections=LOAD_TEST_CONNECTIONS, requests=LOAD_TEST_REQUESTS,
+                    batch=LOAD_TEST_BATCH, host=SERVER_HOST, port=SERVER_PORT, unix=None, seed=None):
+    # each connection sends its requests one after the other, latency is measured per request round trip
+    rng = random.Random(seed)
+    latencies = []
+
+    async def client():
+        reader, writer = await connect(host, port, unix)
+        for i in range(requests):
+            request = {'id': i, 'player': player, 'states': rng.choices(states, k=batch)}
+            start = time.perf_counter()
+            response = await query(reader, writer, request)
+            latencies.append(time.perf_counter() - start)
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'queries': len(latencies) * batch,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'requests_per_sec': len(latencies) / elapsed,
+        'queries_per_sec': len(latencies) * batch / elapsed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the greedy actions of trained qtables over a local socket')
+    parser.add_argument('--ryu', default=qtable_filename(RYU), help='Ryu qtable')
+    parser.add_argument('--ken', default=qtable_filename(KEN), help='Ken qtable')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--unix', help='listen on this unix socket instead of tcp')
+    parser.add_argument('--symmetric', action='store_true', help='tables keep one row per mirrored pair of states')
+    parser.add_argument('--watch', type=float, default=WATCH_SECONDS, help='seconds between two checks of the table files, 0 to disable')
+    parser.add_argument('--load-test', action='store_true', help='query a running server with states of the Ryu table')
+    parser.add_argument('--connections', type=int, default=LOAD_TEST_CONNECTIONS)
+    parser.add_argument('--requests', type=int, default=LOAD_TEST_REQUESTS, help='requests per connection')
+    parser.add_argument('--batch', type=int, default=LOAD_TEST_BATCH, help='states per request')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.load_test:
+        states = list(load_table(args.ryu))
+        results = asyncio.run(load_test(states, RYU, args.connections, args.requests, args.batch,
+                                        args.host, args.port, args.unix, args.seed))
+        print(f"{results['requests']} requests of {args.batch} states over {args.connections} connections: "
+              f"p50 {results['p50_ms']:.3f} ms, p99 {results['p99_ms']:.3f} ms, "
+              f"{results['requests_per_sec']:.0f} requests/s, {results['queries_per_sec']:.0f} queries/s")
+    else:
+        server = PolicyServer({RYU: args.ryu, KEN: args.ken}, args.symmetric, args.watch)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
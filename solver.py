@@ -0,0 +1,204 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from explore import HISTORIES, LOCAL_STATES, build_successors, explore, history_codes, load_dense, split_local
+from logic import (ACTIONS, DISCOUNT_FACTOR, GRID_LIMIT, HISTORY_LENGTH, HIT_DAMAGE, KEN, OPPONENTS, REWARD_WIN, RYU, STANCE_CHANGES,
+                   STANCES)
+from qtable import (ACTION_CODES, NUM_STATES, ORIENTATION_CODES, STANCE_CODES, DenseQTable, encode_states,
+                    save_table)
+from transitions import TRANSITIONS
+
+# health is not in the radar: every hit is taken as the last one of the fight with the chance of one hit
+# in a full health bar
+KILL_PROBABILITY = HIT_DAMAGE / 100
+SOLVER_TOLERANCE = 1e-4
+SOLVER_ITERATIONS = 500
+# the opponent plays 2^OPPONENT_DOUBLINGS moves at most between two turns of the fighter, 64 is a 2^-64 chance
+OPPONENT_DOUBLINGS = 6
+OPPONENT_UNIFORM = 'uniform'
+STANCE_CHANGE_CODES = [ACTION_CODES[action] for action in STANCE_CHANGES]
+
+
+def stance_change_bits(history):
+    # all a fighter's dynamics need from its history: whether its last two actions were a jump or a crouch
+    recent, before = history // len(ACTIONS) ** (HISTORY_LENGTH - 1), history // len(ACTIONS) ** (HISTORY_LENGTH - 2) % len(ACTIONS)
+    return 2 * np.isin(recent, STANCE_CHANGE_CODES) + np.isin(before, STANCE_CHANGE_CODES)
+
+
+class LocalModel:
+    # the reachable states of one fighter (explore.py), merged when they only differ by the parts of the
+    # history that neither its dynamics nor the other fighter's policy read
+    def __init__(self, successors, reached, keep_history):
+        states = np.flatnonzero(reached)
+        position, orientation, stance, history = split_local(states)
+        bits = stance_change_bits(history)
+        memory = history if keep_history else bits
+        keys = ((position * len(ORIENTATION_CODES) + orientation) * len(STANCES) + stance) * HISTORIES + memory
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        lookup = np.full(LOCAL_STATES, -1, dtype=np.int64)
+        lookup[states] = inverse
+        self.full = states
+        self.merged = inverse
+        self.position, self.orientation, self.stance = position[first], orientation[first], stance[first]
+        self.history = history[first]
+        self.resets = (bits[first] & 1).astype(np.int64)
+        self.successors = lookup[successors[states[first]]]
+        assert (self.successors >= 0).all()
+
+    def __len__(self):
+        return len(self.position)
+
+
+def outcome_tables():
+    # reward and hit of every action from TRANSITIONS, indexed by the codes of the local models
+    shape = (GRID_LIMIT, GRID_LIMIT, len(ORIENTATION_CODES), len(STANCES), len(STANCES), 2, len(ACTIONS))
+    rewards, hits = np.zeros(shape), np.zeros(shape, dtype=bool)
+    for (position, opponent_position, orientation, stance, opponent_stance, resets, action), outcome in TRANSITIONS.items():
+        index = (position, opponent_position, ORIENTATION_CODES[orientation], STANCE_CODES[stance],
+                 STANCE_CODES[opponent_stance], int(resets), ACTION_CODES[action])
+        rewards[index], hits[index] = outcome[3], outcome[4]
+    return rewards, hits
+
+
+class Solver:
+    # value iteration on the world seen from one fighter right after its own action, where its radar is read
+    # for its next choice: the opponent then plays k moves with probability 1/2^(k+1) before the chosen action
+    # is applied, exactly the random turn order of Game.round and the stale radar the agents decide on
+    def __init__(self, player, opponent_table=None, discount_factor=DISCOUNT_FACTOR):
+        self.player = player
+        self.discount_factor = discount_factor
+        successors = build_successors()
+        reached = {fighter: explore(successors, fighter)[0] for fighter in [player, OPPONENTS[player]]}
+        # the fighter's whole history only matters when the opponent's table reads it in its radar
+        self.mine = LocalModel(successors, reached[player], opponent_table is not None)
+        self.others = LocalModel(successors, reached[OPPONENTS[player]], False)
+        mine, others = self.mine, self.others
+        rewards, hits = outcome_tables()
+        index = (mine.position[:, None, None], others.position[None, None, :], mine.orientation[:, None, None],
+                 mine.stance[:, None, None], others.stance[None, None, :], mine.resets[:, None, None],
+                 np.arange(len(ACTIONS))[None, :, None])
+        hit = hits[index] * KILL_PROBABILITY
+        self.rewards = rewards[index] + hit * REWARD_WIN
+        self.continues = discount_factor * (1 - hit)
+        if opponent_table is None:
+            self.opponent_moves = None
+            transitions = np.zeros((len(others), len(others)))
+            np.add.at(transitions, (np.arange(len(others))[:, None], others.successors), 1 / len(ACTIONS))
+            self.kernel = 0.5 * np.linalg.inv(np.eye(len(others)) - 0.5 * transitions)
+        else:
+            self.opponent_moves = self.greedy_moves(opponent_table)
+        self.values = np.zeros((len(mine), len(others)))
+        self.qvalues = None
+        self.iterations = 0
+
+    def greedy_moves(self, table):
+        # the opponent's state after its greedy action on its radar, for every pair of states; unlike the
+        # agents it reads its radar fresh, the stale one depends on when it last played
+        mine, others = self.mine, self.others
+        mine_index, others_index = np.repeat(np.arange(len(mine)), len(others)), np.tile(np.arange(len(others)), len(mine))
+        radars = encode_states(others.position[others_index], mine.position[mine_index], mine.stance[mine_index],
+                               others.orientation[others_index], others.stance[others_index],
+                               history_codes(mine.history[mine_index]))
+        actions = table.values[radars].argmax(axis=1)
+        return others.successors[others_index, actions].reshape(len(mine), len(others))
+
+    def before_action(self, outcomes):
+        # expected outcome of the chosen action over the opponent moves played before it: sum over k of
+        # outcomes after k moves weighted 1/2^(k+1)
+        if self.opponent_moves is None:
+            return outcomes @ self.kernel.T
+        total, moves, weight = 0.5 * outcomes, self.opponent_moves, 0.5
+        for _ in range(OPPONENT_DOUBLINGS):
+            total = total + weight * np.take_along_axis(total, moves[:, None, :], axis=2)
+            moves = np.take_along_axis(moves, moves, axis=1)
+            weight *= weight
+        return total
+
+    def solve(self, tolerance=SOLVER_TOLERANCE, max_iterations=SOLVER_ITERATIONS):
+        for self.iterations in range(1, max_iterations + 1):
+            outcomes = self.rewards + self.continues * self.values[self.mine.successors]
+            self.qvalues = self.before_action(outcomes)
+            values = self.qvalues.max(axis=1)
+            delta = float(np.abs(values - self.values).max())
+            self.values = values
+            if delta < tolerance:
+                break
+        return delta
+
+    def radar_table(self):
+        # radar values: average over the world states behind each radar (the fighter's history, the
+        # opponent's orientation, positions out of the radar), all weighted the same
+        mine, others = self.mine, self.others
+        groups_keys = (mine.position * len(ORIENTATION_CODES) + mine.orientation) * len(STANCES) + mine.stance
+        keys, first, groups = np.unique(groups_keys, return_index=True, return_inverse=True)
+        grouped = np.zeros((len(keys), len(ACTIONS), len(others)))
+        np.add.at(grouped, groups, self.qvalues)
+        grouped /= np.bincount(groups)[:, None, None]
+        position, _, stance, history = split_local(others.full)
+        group_index = np.repeat(np.arange(len(keys)), len(others.full))
+        other_index = np.tile(np.arange(len(others.full)), len(keys))
+        radars = encode_states(mine.position[first][group_index], position[other_index], stance[other_index],
+                               mine.orientation[first][group_index], mine.stance[first][group_index],
+                               history_codes(history[other_index]))
+        rows = grouped[group_index, :, others.merged[other_index]]
+        counts = np.bincount(radars, minlength=NUM_STATES)
+        table = DenseQTable(np.float64)
+        for action in range(len(ACTIONS)):
+            table.values[:, action] = np.bincount(radars, rows[:, action], minlength=NUM_STATES)
+        table.visited = counts > 0
+        table.values[table.visited] /= counts[table.visited, None]
+        return table
+
+
+def distance(optimal, trained):
+    # on the radars both tables know: value error, how often the greedy actions agree, and what the
+    # trained greedy action loses against the optimal one
+    states = np.flatnonzero(optimal.visited & trained.visited)
+    if len(states) == 0:
+        return {'states': 0}
+    optimal_rows, trained_rows = optimal.values[states], trained.values[states]
+    greedy = trained_rows.argmax(axis=1)
+    regret = optimal_rows.max(axis=1) - optimal_rows[np.arange(len(states)), greedy]
+    return {
+        'states': len(states),
+        'mean_abs_error': float(np.abs(optimal_rows - trained_rows).mean()),
+        'max_abs_error': float(np.abs(optimal_rows - trained_rows).max()),
+        'policy_agreement': float((greedy == optimal_rows.argmax(axis=1)).mean()),
+        'mean_regret': float(regret.mean()),
+        'max_regret': float(regret.max()),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Optimal qtable of a fighter against a fixed opponent, by value iteration')
+    parser.add_argument('--player', choices=[RYU, KEN], default=RYU)
+    parser.add_argument('--opponent', default=OPPONENT_UNIFORM,
+                        help=f'qtable of the opponent playing its greedy action, or {OPPONENT_UNIFORM} for random actions')
+    parser.add_argument('--discount-factor', type=float, default=DISCOUNT_FACTOR * 100, help='in percent')
+    parser.add_argument('--tolerance', type=float, default=SOLVER_TOLERANCE)
+    parser.add_argument('--output', help='save the solved qtable, e.g. RyuQtable.qtable to warm start a training')
+    parser.add_argument('--compare', help='trained qtable of the same player to measure against the optimal one')
+    parser.add_argument('--report', help='write the results as json')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    opponent = None if args.opponent == OPPONENT_UNIFORM else load_dense(args.opponent)
+    solver = Solver(args.player, opponent, args.discount_factor / 100.0)
+    delta = solver.solve(args.tolerance)
+    table = solver.radar_table()
+    elapsed = time.perf_counter() - start
+    results = {'player': args.player, 'opponent': args.opponent, 'world_states': solver.values.size,
+               'iterations': solver.iterations, 'delta': delta, 'radar_states': len(table), 'elapsed': elapsed}
+    print(f'{args.player} against {args.opponent}: {solver.values.size} world states solved in {solver.iterations} '
+          f'iterations (last change {delta:.1e}), {len(table)} radars, {elapsed:.1f}s')
+    if args.output:
+        save_table(table, args.output)
+    if args.compare:
+        results['distance'] = distance(table, load_dense(args.compare))
+        print(', '.join(f'{key} {value:.4g}' for key, value in results['distance'].items()))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(results, file, indent=2)
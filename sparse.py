@@ -0,0 +1,115 @@
+import argparse
+import sys
+from array import array
+from importlib import import_module
+
+from logic import ACTION_INDEXES, ACTIONS, MAX_WIN, QTABLE_DICT, QTABLE_SPARSE
+
+ZERO_ROW = (0.0,) * len(ACTIONS)
+
+
+def best_index(row):
+    # first maximum in ACTIONS order, the tie-break arg_max gets from dict ordering
+    best = 0
+    for i in range(1, len(row)):
+        if row[i] > row[best]:
+            best = i
+    return best
+
+
+class SparseQTable:
+    # a row is only stored once one of its values is written non-zero, unseen states read as ZERO_ROW
+    __slots__ = ('rows',)
+
+    def __init__(self, rows=None):
+        self.rows = {} if rows is None else rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, state):
+        return state in self.rows
+
+    def __getitem__(self, state):
+        return dict(zip(ACTIONS, self.rows.get(state, ZERO_ROW)))
+
+    def best_action(self, state):
+        row = self.rows.get(state)
+        return ACTIONS[0] if row is None else ACTIONS[best_index(row)]
+
+    def update(self, prev_state, action, reward, new_state, learning_rate, discount_factor):
+        rows = self.rows
+        new_row = rows.get(new_state)
+        max_q = 0.0 if new_row is None else max(new_row)
+        prev_row = rows.get(prev_state)
+        action_id = ACTION_INDEXES[action]
+        q = 0.0 if prev_row is None else prev_row[action_id]
+        value = q + learning_rate * (reward + discount_factor * max_q - q)
+        if prev_row is None:
+            if value == 0.0:
+                return
+            prev_row = rows[prev_state] = array('d', ZERO_ROW)
+        prev_row[action_id] = value
+
+    def items(self):
+        for state, row in self.rows.items():
+            yield state, dict(zip(ACTIONS, row))
+
+    def to_dict(self):
+        return dict(self.items())
+
+    @classmethod
+    def from_dict(cls, table):
+        sparse = cls()
+        for state, actions in table.items():
+            row = array('d', (actions.get(action, 0.0) for action in ACTIONS))
+            if any(row):
+                sparse.rows[state] = row
+        return sparse
+
+    def nbytes(self):
+        return sys.getsizeof(self.rows) + sum(sys.getsizeof(row) for row in self.rows.values())
+
+
+def dict_nbytes(table):
+    # row dicts and the floats they own; zeros share the 0.0 constant and are counted once per table
+    size = sys.getsizeof(table)
+    floats = set()
+    for actions in table.values():
+        size += sys.getsizeof(actions)
+        for value in actions.values():
+            if id(value) not in floats:
+                floats.add(id(value))
+                size += sys.getsizeof(value)
+    return size
+
+
+def train(qtable_backend, wins, seed, learning_rate, discount_factor):
+    game = import_module('no-graphic').NonGraphic(learning_rate, discount_factor, qtable_backend, seed=seed)
+    game.setup()
+    game.max_wins = wins
+    game.train()
+    return game
+
+
+def memory_report(wins=MAX_WIN, seed=0, learning_rate=0.8, discount_factor=0.8):
+    # both backends follow the same trajectory for a given seed, only the storage differs
+    games = {backend: train(backend, wins, seed, learning_rate, discount_factor) for backend in [QTABLE_DICT, QTABLE_SPARSE]}
+    print(f'{wins} wins, {games[QTABLE_DICT].iterations} iterations')
+    for player in ['Ryu', 'Ken']:
+        dict_table = games[QTABLE_DICT].env.agents[player].qtable
+        sparse_table = games[QTABLE_SPARSE].env.agents[player].qtable
+        dict_size, sparse_size = dict_nbytes(dict_table), sparse_table.nbytes()
+        print(f'{player}: dict {len(dict_table)} rows {dict_size / 1e6:.2f} MB, '
+              f'sparse {len(sparse_table)} rows {sparse_size / 1e6:.2f} MB '
+              f'({1 - sparse_size / dict_size:.0%} saved, state keys not counted)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory of the sparse qtable rows against per-state dicts')
+    parser.add_argument('--wins', type=int, default=MAX_WIN)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--learning-rate', type=float, default=80, help='in percent')
+    parser.add_argument('--discount-factor', type=float, default=80, help='in percent')
+    args = parser.parse_args()
+    memory_report(args.wins, args.seed, args.learning_rate / 100.0, args.discount_factor / 100.0)
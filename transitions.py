@@ -0,0 +1,96 @@
+import sys
+import time
+from itertools import product
+
+from logic import (ACTION_DODGE, ACTION_JUMP, ACTION_NONE, ACTIONS, ATTACKS, MOVES, ORIENTATIONS, PLAYERS,
+                   REWARD_HIT, REWARD_NONE, STANCE_CHANGES, STANCE_HIT_MAP, STANCE_STANDING, STANCES,
+                   LogicEnvironment)
+
+# players never stand on a wall cell
+POSITIONS = range(LogicEnvironment.LEFT_WALL + 1, LogicEnvironment.RIGHT_WALL)
+
+
+def transition(position, opponent_position, orientation, stance, opponent_stance, resets, action):
+    # resets: the player's action before last was a jump or a crouch, its stance goes back to standing first
+    reward = 0
+    if resets:
+        stance = STANCE_STANDING
+    if action in MOVES:
+        delta, orientation = MOVES[action]
+        if LogicEnvironment.LEFT_WALL < position + delta < LogicEnvironment.RIGHT_WALL:
+            position += delta
+        reward += REWARD_NONE
+    if action in STANCE_CHANGES:
+        stance = STANCE_CHANGES[action]
+        reward += REWARD_NONE
+    hit = action in STANCE_HIT_MAP[stance][opponent_stance] and opponent_position == position + orientation
+    if action in ATTACKS:
+        reward += REWARD_HIT if hit else REWARD_NONE
+    if action == ACTION_DODGE or action == ACTION_NONE:
+        reward += REWARD_NONE
+    return position, orientation, stance, reward, hit
+
+
+def local_states():
+    return product(POSITIONS, POSITIONS, ORIENTATIONS, STANCES, STANCES, [False, True], ACTIONS)
+
+
+def build_transitions():
+    return {key: transition(*key) for key in local_states()}
+
+
+TRANSITIONS = build_transitions()
+
+
+def set_local_state(env, player, position, opponent_position, orientation, stance, opponent_stance, resets, action):
+    opponent = env.opponent(player)
+    env.reset()
+    env.positions[player], env.positions[opponent] = position, opponent_position
+    env.orientations[player] = orientation
+    env.agents[player].orientation = orientation
+    env.stances[player], env.stances[opponent] = stance, opponent_stance
+    env.agents[player].set_previous_actions([ACTION_NONE, ACTION_JUMP if resets else ACTION_NONE, ACTION_NONE])
+    env.agents[player].current_action = action
+    env.invalidate_radars()
+
+
+def outcome(env, player, reward, radar):
+    opponent = env.opponent(player)
+    return (env.positions[player], env.orientations[player], env.agents[player].orientation, env.stances[player],
+            env.agents[opponent].health, reward, radar)
+
+
+def validate():
+    # every reachable local state, for both players, through the rule-by-rule do and the table lookup
+    reference, table = LogicEnvironment(), LogicEnvironment()
+    table.use_transition_table()
+    mismatches = []
+    for player in PLAYERS:
+        for key in local_states():
+            set_local_state(reference, player, *key)
+            set_local_state(table, player, *key)
+            expected = outcome(reference, player, *reference.do(player))
+            result = outcome(table, player, *table.do(player))
+            if expected != result:
+                mismatches.append((player, key, expected, result))
+    return mismatches
+
+
+def time_do(env, steps):
+    agent = env.agents[PLAYERS[0]]
+    start = time.perf_counter()
+    for i in range(steps):
+        agent.current_action = ACTIONS[i % len(ACTIONS)]
+        env.do(PLAYERS[0])
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    mismatches = validate()
+    print(f'{len(TRANSITIONS)} local states per player, {len(mismatches)} mismatches')
+    for mismatch in mismatches[:10]:
+        print(*mismatch)
+    reference, table = LogicEnvironment(), LogicEnvironment()
+    table.use_transition_table()
+    print(f'do: {time_do(reference, 200_000):.0f} calls/s, transition table: {time_do(table, 200_000):.0f} calls/s')
+    sys.exit(1 if mismatches else 0)